@@ -1,9 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import functools
+import hashlib
 import os
 import json
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+import numpy as np
 
 app = FastAPI()
 
@@ -14,8 +28,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Compress responses above this many bytes (large batch results)
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MINIMUM_SIZE", "1024")))
+
 # Global variables for models
 llm_model = None
 embedding_model = None
@@ -39,6 +57,7 @@ class NutritionInput(BaseModel):
     potassium: Optional[float] = 0
     serving_size: Optional[str] = "1 serving"
     food_name: Optional[str] = "Food Item"
+    category: Optional[str] = None  # Food catalog category used for percentile ranking
 
 class HealthGoalInput(BaseModel):
     nutrition_data: NutritionInput
@@ -49,9 +68,40 @@ class DietCompatibilityInput(BaseModel):
     diet_type: str  # "keto", "vegan", "paleo", "mediterranean", "low_sodium"
 
 class ConversationalInput(BaseModel):
-    nutrition_data: NutritionInput
+    nutrition_data: Optional[NutritionInput] = None
     question: str
     context: Optional[str] = ""
+    session_id: Optional[str] = None  # Reuse a server-side chat session instead of resending nutrition_data
+    start_session: Optional[bool] = False  # Keep this conversation server-side and return its session_id
+
+class ChatSessionInput(BaseModel):
+    nutrition_data: NutritionInput
+    context: Optional[str] = ""  # Kept with the session for every turn
+
+class CatalogFood(NutritionInput):
+    category: str
+    id: Optional[str] = None  # Generated when omitted; an existing id updates that food
+
+class NutritionProfileInput(BaseModel):
+    age: int
+    weight_kg: float
+    activity_level: str = "moderate"  # "sedentary", "light", "moderate", "active", "very_active"
+    height_cm: Optional[float] = None  # Assumed 170 when unknown
+    sex: Optional[str] = None  # "male", "female"; averaged when unknown
+
+class KnowledgeDocument(BaseModel):
+    id: Optional[str] = None  # Omit to add a new document, reuse an id to replace its text
+    text: str
+    source: Optional[str] = "admin"
+
+class KnowledgeDeleteInput(BaseModel):
+    ids: List[str]
+
+class BatchJobInput(BaseModel):
+    records: List[NutritionInput]
+    health_goal: Optional[str] = None  # Also score each record for this goal
+    diet_type: Optional[str] = None  # Also score each record for this diet
+    profile_id: Optional[str] = None  # Score against a personalized profile
 
 # RAG Knowledge Base
 NUTRITION_GUIDELINES = {
@@ -109,9 +159,993 @@ NUTRITION_GUIDELINES = {
     }
 }
 
+# Scoring thresholds, each scaled by the ratio of a personal daily value to the
+# global one: name -> (daily value nutrient, threshold for the global adult)
+SCALED_THRESHOLDS = {
+    "weight_loss_max_calories": ("calories", 300),
+    "weight_loss_max_fat": ("total_fat", 10),
+    "weight_loss_max_added_sugars": ("added_sugars", 5),
+    "muscle_gain_min_protein": ("protein", 15),
+    "muscle_gain_min_calories": ("calories", 200),
+    "heart_health_max_sodium": ("sodium", 400),
+    "heart_health_max_saturated_fat": ("saturated_fat", 3),
+    "heart_health_min_fiber": ("dietary_fiber", 5),
+    "diabetes_max_added_sugars": ("added_sugars", 3),
+    "diabetes_min_fiber": ("dietary_fiber", 5),
+    "overall_min_fiber": ("dietary_fiber", 5),
+    "overall_min_protein": ("protein", 10),
+    "warning_max_calories": ("calories", 500)
+}
+# Thresholds defined as a fraction of a daily value
+DAILY_VALUE_FRACTIONS = {
+    "overall_max_added_sugars": ("added_sugars", 0.2),
+    "overall_max_sodium": ("sodium", 0.3),
+    "overall_max_saturated_fat": ("saturated_fat", 0.3),
+    "warning_max_sodium": ("sodium", 0.4),
+    "warning_max_added_sugars": ("added_sugars", 0.3),
+    "warning_max_saturated_fat": ("saturated_fat", 0.4)
+}
+ACTIVITY_FACTORS = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "active": 1.725, "very_active": 1.9}
+
+def compile_scorer(daily_values: Dict[str, float], profile_id: Optional[str] = None) -> Dict[str, Any]:
+    """Compile daily values into the flat threshold set used by the scoring helpers"""
+    base = NUTRITION_GUIDELINES["daily_values"]
+    thresholds = {
+        name: value * (daily_values[nutrient] / base[nutrient])
+        for name, (nutrient, value) in SCALED_THRESHOLDS.items()
+    }
+    thresholds.update({
+        name: daily_values[nutrient] * fraction
+        for name, (nutrient, fraction) in DAILY_VALUE_FRACTIONS.items()
+    })
+    return {
+        "profile_id": profile_id,
+        "daily_values": daily_values,
+        "thresholds": thresholds,
+        "fingerprint": hashlib.sha256(json.dumps(daily_values, sort_keys=True).encode()).hexdigest()[:16]
+    }
+
+GLOBAL_SCORER = compile_scorer(NUTRITION_GUIDELINES["daily_values"])
+
+def derive_personal_daily_values(profile: NutritionProfileInput) -> Dict[str, float]:
+    """Personal daily values from age, weight, height, sex and activity level"""
+    height_cm = profile.height_cm or 170
+    sex_offset = {"male": 5, "female": -161}.get((profile.sex or "").lower(), -78)
+    # Mifflin-St Jeor resting energy, scaled by activity
+    calories = (10 * profile.weight_kg + 6.25 * height_cm - 5 * profile.age + sex_offset) * ACTIVITY_FACTORS[profile.activity_level]
+    calories = round(max(calories, 1200))
+    base = NUTRITION_GUIDELINES["daily_values"]
+    energy_ratio = calories / base["calories"]
+    
+    protein_per_kg = 1.2 if profile.activity_level in ("active", "very_active") else (1.0 if profile.age >= 65 else 0.8)
+    return {
+        "calories": calories,
+        "total_fat": round(base["total_fat"] * energy_ratio, 1),
+        "saturated_fat": round(base["saturated_fat"] * energy_ratio, 1),
+        "cholesterol": base["cholesterol"],
+        "sodium": 1500 if profile.age >= 51 else base["sodium"],
+        "total_carbs": round(base["total_carbs"] * energy_ratio, 1),
+        "dietary_fiber": round(14 * calories / 1000, 1),  # 14 g per 1000 kcal
+        "protein": round(max(protein_per_kg * profile.weight_kg, 0.1 * calories / 4), 1),
+        "added_sugars": round(base["added_sugars"] * energy_ratio, 1)
+    }
+
+@contextmanager
+def sqlite_connection(path: str):
+    """Short-lived SQLite connection whose block runs as one transaction"""
+    db = sqlite3.connect(path, timeout=30)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+def atomic_write_json(path: str, data: Any):
+    """Write JSON through a temp file and rename, so readers never see a partial file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(data, json_file, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+# Profile configuration
+PROFILE_DB_PATH = os.environ.get(
+    "PROFILE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles.db")
+)
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "10000"))
+
+class ProfileStore:
+    """Nutrition profiles in SQLite with an LRU cache of compiled scorers"""
+
+    def __init__(self, db_path: str, cache_size: int):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.scorers: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0  # Bumped by every write, so scorers compiled from an older read are not cached
+
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS nutrition_profiles "
+                "(profile_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite_connection(self.db_path)
+
+    def save(self, profile: NutritionProfileInput, profile_id: Optional[str] = None) -> str:
+        profile_id = profile_id or uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO nutrition_profiles (profile_id, data, updated_at) VALUES (?, ?, ?)",
+                (profile_id, profile.model_dump_json(), time.time())
+            )
+        with self.lock:
+            self.generation += 1
+            self.scorers.pop(profile_id, None)
+        return profile_id
+
+    def load(self, profile_id: str) -> Optional[NutritionProfileInput]:
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM nutrition_profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+        return NutritionProfileInput.model_validate_json(row[0]) if row else None
+
+    def delete(self, profile_id: str) -> bool:
+        with self._connect() as db:
+            deleted = db.execute("DELETE FROM nutrition_profiles WHERE profile_id = ?", (profile_id,)).rowcount > 0
+        with self.lock:
+            self.generation += 1
+            self.scorers.pop(profile_id, None)
+        return deleted
+
+    def cached_scorer(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """Compiled scorer if cached, without touching the database"""
+        with self.lock:
+            scorer = self.scorers.get(profile_id)
+            if scorer is not None:
+                self.scorers.move_to_end(profile_id)
+            return scorer
+
+    def get_scorer(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """Compiled scorer for a profile, compiling and caching it on first use"""
+        scorer = self.cached_scorer(profile_id)
+        if scorer is not None:
+            return scorer
+        
+        with self.lock:
+            generation = self.generation
+        profile = self.load(profile_id)
+        if profile is None:
+            return None
+        scorer = compile_scorer(derive_personal_daily_values(profile), profile_id)
+        with self.lock:
+            # A write since the read may have made this scorer stale; use it once but don't cache it
+            if self.generation == generation:
+                self.scorers[profile_id] = scorer
+                while len(self.scorers) > self.cache_size:
+                    self.scorers.popitem(last=False)
+        return scorer
+
+profile_store = None
+
+def resolve_scorer(profile_id: Optional[str]) -> Dict[str, Any]:
+    """Scorer for a request: the profile's when given, otherwise the global one"""
+    if not profile_id:
+        return GLOBAL_SCORER
+    scorer = profile_store.get_scorer(profile_id)
+    if scorer is None:
+        raise HTTPException(status_code=404, detail="Nutrition profile not found")
+    return scorer
+
+async def resolve_scorer_async(profile_id: Optional[str]) -> Dict[str, Any]:
+    """resolve_scorer for endpoints: cache hits stay on the event loop, misses read SQLite in a thread"""
+    if not profile_id:
+        return GLOBAL_SCORER
+    scorer = profile_store.cached_scorer(profile_id)
+    if scorer is not None:
+        return scorer
+    return await asyncio.to_thread(resolve_scorer, profile_id)
+
+# Analysis results are pure functions of the payload and the guidelines,
+# so they are identified by a content hash that changes with either
+GUIDELINES_VERSION = hashlib.sha256(json.dumps(NUTRITION_GUIDELINES, sort_keys=True).encode()).hexdigest()[:16]
+ANALYSIS_CACHE_MAX_AGE = int(os.environ.get("ANALYSIS_CACHE_MAX_AGE", "3600"))
+
+def compute_analysis_etag(endpoint: str, nutrition: NutritionInput, params: Optional[Dict[str, Any]] = None) -> str:
+    """Weak ETag for an analysis result
+    
+    Weak because GZipMiddleware may send the same result gzip-encoded or not,
+    and a strong ETag must identify exact bytes.
+    """
+    content = json.dumps({
+        "endpoint": endpoint,
+        "nutrition": nutrition.model_dump(),
+        "params": params or {},
+        "guidelines_version": GUIDELINES_VERSION,
+        "catalog_version": food_catalog.version if food_catalog else None,
+        "knowledge_version": rag_knowledge_base["version"] if rag_knowledge_base else None
+    }, sort_keys=True)
+    return 'W/"' + hashlib.sha256(content.encode()).hexdigest()[:32] + '"'
+
+def check_not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Set caching headers and return a 304 response if the client already has this result"""
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={ANALYSIS_CACHE_MAX_AGE}"}
+    response.headers.update(headers)
+    
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored on both sides
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if "*" in candidates or etag.removeprefix("W/") in candidates:
+        return Response(status_code=304, headers=headers)
+    return None
+
+# Response fields per analysis endpoint, in response order
+SIMPLIFY_FIELDS = ["simplified_explanation", "daily_value_percentages", "key_insights", "percentiles"]
+HEALTH_GOAL_FIELDS = ["health_goal", "suitability_verdict", "suitability_score", "recommendation", "goal_info", "percentiles"]
+DIET_COMPATIBILITY_FIELDS = ["diet_type", "compatibility_explanation", "compatibility_score", "is_compatible", "diet_info", "specific_concerns", "percentiles"]
+WARNINGS_FIELDS = ["ai_analysis", "health_warnings", "alternative_suggestions", "overall_health_score", "improvement_tips", "percentiles"]
+
+def parse_fields(fields: Optional[str], available: List[str]) -> List[str]:
+    """Parse a comma-separated `fields` parameter; all fields when omitted"""
+    if not fields:
+        return list(available)
+    
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - set(available)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(available)}"
+        )
+    return [name for name in available if name in names]
+
+def evaluate_fields(requested: List[str], builders: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the response, calling only the builders for requested fields"""
+    return {name: builders[name]() for name in requested}
+
+# Chat session configuration
+CHAT_SESSION_MAX_SESSIONS = int(os.environ.get("CHAT_SESSION_MAX_SESSIONS", "1000"))
+CHAT_SESSION_MAX_TURNS = int(os.environ.get("CHAT_SESSION_MAX_TURNS", "6"))
+CHAT_SESSION_SUMMARY_MAX_CHARS = int(os.environ.get("CHAT_SESSION_SUMMARY_MAX_CHARS", "600"))
+CHAT_SESSION_STORE_PATH = os.environ.get("CHAT_SESSION_STORE_PATH", "")  # Empty keeps sessions in memory only
+CHAT_SESSION_FLUSH_INTERVAL = float(os.environ.get("CHAT_SESSION_FLUSH_INTERVAL", "1.0"))
+
+class ChatSessionStore:
+    """Bounded LRU store of chat sessions with optional SQLite persistence
+    
+    Changes are only marked dirty on the request path; a background thread
+    writes them to SQLite in one transaction every `flush_interval` seconds.
+    """
+
+    def __init__(self, max_sessions: int, max_turns: int, summary_max_chars: int, store_path: str = "",
+                 flush_interval: float = 1.0):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.summary_max_chars = summary_max_chars
+        self.store_path = store_path
+        self.flush_interval = flush_interval
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.dirty = set()
+        self.deleted = set()
+        self.stopping = threading.Event()
+        self.flusher = None
+
+        if store_path:
+            self.db = sqlite3.connect(store_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions "
+                "(session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.db.commit()
+            self._load()
+            self.flusher = threading.Thread(target=self._flush_loop, name="chat-session-flush", daemon=True)
+            self.flusher.start()
+
+    def _load(self):
+        """Load the most recently used sessions from disk, oldest first"""
+        rows = self.db.execute(
+            "SELECT session_id, data FROM chat_sessions ORDER BY updated_at DESC LIMIT ?",
+            (self.max_sessions,)
+        ).fetchall()
+        for session_id, data in reversed(rows):
+            self.sessions[session_id] = json.loads(data)
+        self.db.execute(
+            "DELETE FROM chat_sessions WHERE session_id NOT IN "
+            "(SELECT session_id FROM chat_sessions ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_sessions,)
+        )
+        self.db.commit()
+
+    def _persist(self, session_id: str, evicted: List[str]):
+        # Called with self.lock held; the flusher thread does the writing
+        if not self.db:
+            return
+        if session_id in self.sessions:
+            self.dirty.add(session_id)
+            self.deleted.discard(session_id)
+        for evicted_id in evicted:
+            self.dirty.discard(evicted_id)
+            self.deleted.add(evicted_id)
+
+    def _flush_loop(self):
+        while not self.stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error persisting chat sessions: {e}")
+
+    def flush(self):
+        """Write dirty sessions and deletions to SQLite"""
+        if not self.db:
+            return
+        with self.lock:
+            rows = [
+                (session_id, json.dumps(self.sessions[session_id]), self.sessions[session_id]["updated_at"])
+                for session_id in self.dirty if session_id in self.sessions
+            ]
+            deleted = [(session_id,) for session_id in self.deleted]
+            self.dirty.clear()
+            self.deleted.clear()
+        if not rows and not deleted:
+            return
+        with self.db_lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO chat_sessions (session_id, data, updated_at) VALUES (?, ?, ?)", rows
+            )
+            self.db.executemany("DELETE FROM chat_sessions WHERE session_id = ?", deleted)
+            self.db.commit()
+
+    def close(self):
+        """Stop the flusher and write any pending changes"""
+        self.stopping.set()
+        if self.flusher:
+            self.flusher.join()
+        self.flush()
+
+    def create(self, nutrition_data: Dict[str, Any], context: str = "") -> str:
+        """Create a session holding the given nutrition record, under a server-minted id"""
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self._start(session_id, nutrition_data, context)
+        return session_id
+
+    def reset(self, session_id: str, nutrition_data: Dict[str, Any], context: str = "") -> bool:
+        """Restart an existing session with a new nutrition record; False if it does not exist"""
+        with self.lock:
+            if session_id not in self.sessions:
+                return False
+            self._start(session_id, nutrition_data, context)
+        return True
+
+    def _start(self, session_id: str, nutrition_data: Dict[str, Any], context: str):
+        # Called with self.lock held; the initial context is kept for every later turn
+        now = time.time()
+        self.sessions[session_id] = {
+            "nutrition_data": nutrition_data,
+            "context": (context or "")[:self.summary_max_chars],
+            "turns": [],
+            "summary": "",
+            "created_at": now,
+            "updated_at": now
+        }
+        self.sessions.move_to_end(session_id)
+        evicted = []
+        while len(self.sessions) > self.max_sessions:
+            evicted_id, _ = self.sessions.popitem(last=False)
+            evicted.append(evicted_id)
+        self._persist(session_id, evicted)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return a session and mark it as recently used"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self.lock:
+            existed = self.sessions.pop(session_id, None) is not None
+            if existed:
+                self._persist(session_id, [session_id])
+            return existed
+
+    def add_turn(self, session_id: str, question: str, answer: str):
+        """Record a turn, folding turns beyond the window into the rolling summary"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return
+            session["turns"].append({"question": question, "answer": answer})
+            while len(session["turns"]) > self.max_turns:
+                oldest = session["turns"].pop(0)
+                session["summary"] = self._fold_into_summary(session["summary"], oldest)
+            session["updated_at"] = time.time()
+            self.sessions.move_to_end(session_id)
+            self._persist(session_id, [])
+
+    def _fold_into_summary(self, summary: str, turn: Dict[str, str]) -> str:
+        # Keep only the first sentence of each answer and drop the oldest text once over budget
+        first_sentence = turn["answer"].split(". ")[0].rstrip(".")
+        summary = f"{summary} Asked '{turn['question']}': {first_sentence}.".strip()
+        if len(summary) > self.summary_max_chars:
+            summary = summary[-self.summary_max_chars:]
+        return summary
+
+    def build_context(self, session: Dict[str, Any]) -> str:
+        """Compact conversation context for the prompt"""
+        parts = []
+        if session.get("context"):
+            parts.append(session["context"])
+        if session["summary"]:
+            parts.append(f"Earlier: {session['summary']}")
+        for turn in session["turns"]:
+            parts.append(f"Q: {turn['question']} A: {turn['answer']}")
+        return " ".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "max_turns": self.max_turns,
+            "persistent": self.db is not None
+        }
+
+chat_sessions = None
+
+# Chat WebSocket configuration
+CHAT_WS_IDLE_TIMEOUT = float(os.environ.get("CHAT_WS_IDLE_TIMEOUT", "300"))
+CHAT_WS_MAX_PENDING = int(os.environ.get("CHAT_WS_MAX_PENDING", "8"))
+
+# Food catalog configuration
+# The bundled catalog is a read-only seed; admin changes are written to FOOD_CATALOG_PATH
+FOOD_CATALOG_SEED_PATH = os.environ.get(
+    "FOOD_CATALOG_SEED_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "food_catalog.json")
+)
+FOOD_CATALOG_PATH = os.environ.get(
+    "FOOD_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "food_catalog.local.json")
+)
+RANKED_NUTRIENTS = [
+    "calories", "total_fat", "saturated_fat", "trans_fat", "cholesterol", "sodium",
+    "total_carbs", "dietary_fiber", "total_sugars", "added_sugars", "protein"
+]
+ALL_CATEGORIES = "all"
+
+class FoodCatalog:
+    """Local food dataset with per-category sorted columns for percentile ranking
+    
+    Each category (plus "all") maps every ranked nutrient and the overall
+    health score to a sorted NumPy array, so ranking a value is a binary
+    search. Changes insert or delete single values in the affected
+    categories' arrays and swap in the new column set, so readers always
+    see a consistent snapshot.
+    """
+
+    def __init__(self, path: str, seed_path: Optional[str] = None):
+        self.path = path
+        self.foods: Dict[str, Dict[str, Any]] = {}
+        self.columns: Dict[str, Dict[str, np.ndarray]] = {}
+        self.lock = threading.Lock()
+
+        load_path = path if os.path.exists(path) else seed_path
+        if load_path and os.path.exists(load_path):
+            with open(load_path) as catalog_file:
+                for record in json.load(catalog_file):
+                    food = CatalogFood(**record)
+                    self.foods[food.id] = food.model_dump()
+        self.version = self._content_version(self.foods)
+        self._rebuild()
+
+    @staticmethod
+    def _content_version(foods: Dict[str, Dict[str, Any]]) -> str:
+        """Hash of the catalog contents, identical across processes holding the same data"""
+        # Numbers are compared as floats: unvalidated defaults stay ints until a reload
+        content = json.dumps([
+            {key: float(value) if isinstance(value, int) else value for key, value in foods[food_id].items()}
+            for food_id in sorted(foods)
+        ], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _ranked_values(food: Dict[str, Any]) -> Dict[str, float]:
+        values = {nutrient: float(food.get(nutrient) or 0) for nutrient in RANKED_NUTRIENTS}
+        values["overall_health_score"] = float(calculate_overall_health_score(NutritionInput(**food)))
+        return values
+
+    def _rebuild(self):
+        """Build every category's sorted columns from scratch"""
+        grouped: Dict[str, List[Dict[str, float]]] = {}
+        for food in self.foods.values():
+            values = self._ranked_values(food)
+            grouped.setdefault(food["category"], []).append(values)
+            grouped.setdefault(ALL_CATEGORIES, []).append(values)
+        self.columns = {
+            category: {
+                column: np.sort(np.array([values[column] for values in rows]))
+                for column in RANKED_NUTRIENTS + ["overall_health_score"]
+            }
+            for category, rows in grouped.items()
+        }
+
+    def _shift(self, columns: Dict[str, Dict[str, np.ndarray]], category: str, values: Dict[str, float], add: bool):
+        # Copy-on-write: only the arrays of the touched category are replaced
+        current = columns.get(category)
+        updated = {}
+        for column, value in values.items():
+            array = current[column] if current else np.empty(0)
+            if add:
+                updated[column] = np.insert(array, np.searchsorted(array, value), value)
+            else:
+                updated[column] = np.delete(array, np.searchsorted(array, value))
+        if updated and len(next(iter(updated.values()))) == 0:
+            columns.pop(category, None)
+        else:
+            columns[category] = updated
+
+    def upsert(self, foods: List[CatalogFood]) -> List[str]:
+        """Add or replace foods, updating only the affected categories"""
+        with self.lock:
+            # Stage foods and columns together so a failure part-way leaves both untouched
+            staged_foods = dict(self.foods)
+            columns = dict(self.columns)
+            ids = []
+            for food in foods:
+                record = food.model_dump()
+                record["id"] = record["id"] or uuid.uuid4().hex
+                previous = staged_foods.get(record["id"])
+                if previous is not None:
+                    old_values = self._ranked_values(previous)
+                    self._shift(columns, previous["category"], old_values, add=False)
+                    self._shift(columns, ALL_CATEGORIES, old_values, add=False)
+                new_values = self._ranked_values(record)
+                self._shift(columns, record["category"], new_values, add=True)
+                self._shift(columns, ALL_CATEGORIES, new_values, add=True)
+                staged_foods[record["id"]] = record
+                ids.append(record["id"])
+            self._commit(staged_foods, columns)
+        return ids
+
+    def remove(self, food_id: str) -> bool:
+        with self.lock:
+            previous = self.foods.get(food_id)
+            if previous is None:
+                return False
+            staged_foods = dict(self.foods)
+            del staged_foods[food_id]
+            columns = dict(self.columns)
+            old_values = self._ranked_values(previous)
+            self._shift(columns, previous["category"], old_values, add=False)
+            self._shift(columns, ALL_CATEGORIES, old_values, add=False)
+            self._commit(staged_foods, columns)
+        return True
+
+    def _commit(self, foods: Dict[str, Dict[str, Any]], columns: Dict[str, Dict[str, np.ndarray]]):
+        # Called with self.lock held; saved first so a write error changes nothing
+        self._save(foods)
+        self.foods = foods
+        self.columns = columns
+        self.version = self._content_version(foods)
+
+    def _save(self, foods: Dict[str, Dict[str, Any]]):
+        atomic_write_json(self.path, list(foods.values()))
+
+    def rank(self, nutrition: NutritionInput) -> Optional[Dict[str, Any]]:
+        """Percent of catalog foods in the same category with a lower value, per nutrient
+        
+        Catalog foods are scored with the global guidelines, so the item's overall
+        health score is ranked on that same scale for every profile. The response
+        names the global score it ranked, which can differ from a personalized
+        overall_health_score reported next to it.
+        """
+        category = nutrition.category if nutrition.category in self.columns else ALL_CATEGORIES
+        columns = self.columns.get(category)
+        if not columns:
+            return None
+        
+        values = self._ranked_values(nutrition.model_dump())
+        size = len(columns["calories"])
+        percentiles = {
+            column: round(float(np.searchsorted(columns[column], value)) / size * 100, 1)
+            for column, value in values.items()
+        }
+        return {
+            "category": category,
+            "compared_with": size,
+            "scoring": "global",
+            "global_overall_health_score": int(values["overall_health_score"]),
+            "overall_health_score": percentiles.pop("overall_health_score"),
+            "nutrients": percentiles
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        columns = self.columns
+        return {
+            "version": self.version,
+            "foods": len(self.foods),
+            "categories": {
+                category: len(category_columns["calories"])
+                for category, category_columns in columns.items() if category != ALL_CATEGORIES
+            }
+        }
+
+food_catalog = None
+
+# Batch job configuration
+BATCH_JOB_DB_PATH = os.environ.get(
+    "BATCH_JOB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_jobs.db")
+)
+BATCH_JOB_WORKERS = int(os.environ.get("BATCH_JOB_WORKERS", "2"))
+BATCH_JOB_CHUNK_SIZE = int(os.environ.get("BATCH_JOB_CHUNK_SIZE", "500"))
+BATCH_JOB_MAX_RECORDS = int(os.environ.get("BATCH_JOB_MAX_RECORDS", "100000"))
+BATCH_JOB_LEASE_SECONDS = float(os.environ.get("BATCH_JOB_LEASE_SECONDS", "60"))
+
+class BatchJobManager:
+    """SQLite-backed batch jobs processed in chunks by a local worker pool
+    
+    Every chunk's results and the job's progress are committed together, so a
+    restarted server resumes each unfinished job from its last finished chunk.
+    
+    Several processes may share the database (uvicorn --workers, replicas). A
+    job only runs after this manager claims it with a conditional UPDATE,
+    which takes a lease renewed with every chunk; jobs whose owner stopped
+    renewing are picked up by the periodic resume of a live process.
+    """
+
+    def __init__(self, db_path: str, workers: int, chunk_size: int, lease_seconds: float = 60):
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-job")
+        self.stopping = threading.Event()
+        self.scheduled = set()  # Jobs submitted to this executor and not finished yet
+        self.scheduled_lock = threading.Lock()
+        self.reaper = None
+
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS batch_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    chunks_done INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    owner TEXT,
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS batch_job_records (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS batch_job_results (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                );
+            """)
+            # Databases created before jobs were claimed lack the lease columns
+            columns = {row[1] for row in db.execute("PRAGMA table_info(batch_jobs)")}
+            for column, column_type in [("owner", "TEXT"), ("lease_expires", "REAL")]:
+                if column not in columns:
+                    db.execute(f"ALTER TABLE batch_jobs ADD COLUMN {column} {column_type}")
+
+    def _connect(self):
+        return sqlite_connection(self.db_path)
+
+    def resume(self) -> int:
+        """Schedule unfinished jobs no live process holds, including those left by a previous one"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT job_id FROM batch_jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)) ORDER BY created_at",
+                (time.time(),)
+            ).fetchall()
+        return sum(self._schedule(job_id) for (job_id,) in rows)
+
+    def start_reaper(self):
+        """Periodically resume jobs whose owner stopped renewing its lease"""
+        def reap():
+            while not self.stopping.wait(self.lease_seconds):
+                try:
+                    self.resume()
+                except Exception as e:
+                    print(f"Error resuming batch jobs: {e}")
+        
+        self.reaper = threading.Thread(target=reap, name="batch-job-reaper", daemon=True)
+        self.reaper.start()
+
+    def shutdown(self):
+        # Workers stop after their current chunk; jobs held here are released so
+        # the next process, or another live one, resumes them right away
+        self.stopping.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self._connect() as db:
+            db.execute(
+                "UPDATE batch_jobs SET status = 'queued', owner = NULL, lease_expires = NULL "
+                "WHERE owner = ? AND status = 'running'",
+                (self.owner,)
+            )
+
+    def _schedule(self, job_id: str) -> bool:
+        with self.scheduled_lock:
+            if job_id in self.scheduled:
+                return False
+            self.scheduled.add(job_id)
+        self.executor.submit(self._run, job_id)
+        return True
+
+    def _claim(self, db: sqlite3.Connection, job_id: str) -> bool:
+        """Take the lease on a queued or abandoned job; False if another process holds it"""
+        now = time.time()
+        return db.execute(
+            "UPDATE batch_jobs SET status = 'running', owner = ?, lease_expires = ?, updated_at = ? "
+            "WHERE job_id = ? AND (status = 'queued' OR (status = 'running' AND "
+            "(owner IS NULL OR lease_expires IS NULL OR lease_expires < ?)))",
+            (self.owner, now + self.lease_seconds, now, job_id, now)
+        ).rowcount == 1
+
+    def _renew(self, db: sqlite3.Connection, job_id: str) -> bool:
+        """Extend this process's lease; False once it was released or taken over"""
+        now = time.time()
+        return db.execute(
+            "UPDATE batch_jobs SET lease_expires = ?, updated_at = ? WHERE job_id = ? AND status = 'running' AND owner = ?",
+            (now + self.lease_seconds, now, job_id, self.owner)
+        ).rowcount == 1
+
+    def submit(self, records: List[NutritionInput], params: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO batch_jobs (job_id, status, params, total, chunk_size, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(params), len(records), self.chunk_size, now, now)
+            )
+            db.executemany(
+                "INSERT INTO batch_job_records (job_id, idx, data) VALUES (?, ?, ?)",
+                ((job_id, idx, record.model_dump_json()) for idx, record in enumerate(records))
+            )
+        self._schedule(job_id)
+        return job_id
+
+    def _run(self, job_id: str):
+        try:
+            with self._connect() as db:
+                if not self._claim(db, job_id):
+                    return
+                job = db.execute(
+                    "SELECT params, total, chunk_size, chunks_done FROM batch_jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+            params, total, chunk_size, chunks_done = json.loads(job[0]), job[1], job[2], job[3]
+            chunk_count = (total + chunk_size - 1) // chunk_size
+
+            for chunk in range(chunks_done, chunk_count):
+                if self.stopping.is_set():
+                    return
+                start = chunk * chunk_size
+                with self._connect() as db:
+                    rows = db.execute(
+                        "SELECT idx, data FROM batch_job_records WHERE job_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                        (job_id, start, start + chunk_size)
+                    ).fetchall()
+                results = [
+                    (job_id, idx, json.dumps(analyze_batch_record(NutritionInput.model_validate_json(data), **params)))
+                    for idx, data in rows
+                ]
+                with self._connect() as db:
+                    # The lease is renewed first, so a chunk is only written while this process holds the job
+                    if not self._renew(db, job_id):
+                        return
+                    db.executemany("INSERT OR REPLACE INTO batch_job_results (job_id, idx, data) VALUES (?, ?, ?)", results)
+                    db.execute(
+                        "UPDATE batch_jobs SET chunks_done = ?, updated_at = ? WHERE job_id = ?",
+                        (chunk + 1, time.time(), job_id)
+                    )
+
+            with self._connect() as db:
+                completed = db.execute(
+                    "UPDATE batch_jobs SET status = 'completed', owner = NULL, lease_expires = NULL, updated_at = ? "
+                    "WHERE job_id = ? AND owner = ?",
+                    (time.time(), job_id, self.owner)
+                ).rowcount == 1
+                if completed:
+                    db.execute("DELETE FROM batch_job_records WHERE job_id = ?", (job_id,))
+        except Exception as e:
+            print(f"Batch job {job_id} failed: {e}")
+            with self._connect() as db:
+                db.execute(
+                    "UPDATE batch_jobs SET status = 'failed', error = ?, owner = NULL, lease_expires = NULL, "
+                    "updated_at = ? WHERE job_id = ? AND owner = ?",
+                    (str(e), time.time(), job_id, self.owner)
+                )
+        finally:
+            with self.scheduled_lock:
+                self.scheduled.discard(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT status, params, total, chunk_size, chunks_done, error, created_at, updated_at "
+                "FROM batch_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, params, total, chunk_size, chunks_done, error, created_at, updated_at = row
+        processed = min(total, chunks_done * chunk_size)
+        return {
+            "job_id": job_id,
+            "status": status,
+            "params": json.loads(params),
+            "total": total,
+            "processed": processed,
+            "progress": round(processed / total * 100, 1) if total else 100.0,
+            "chunks_done": chunks_done,
+            "chunk_count": (total + chunk_size - 1) // chunk_size,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def results(self, job_id: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT idx, data FROM batch_job_results WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                (job_id, offset, limit)
+            ).fetchall()
+        return [{"index": idx, **json.loads(data)} for idx, data in rows]
+
+batch_jobs = None
+
+# Admin endpoints (knowledge base and catalog writes, knowledge stats) require this token in X-Admin-Token;
+# they are disabled while it is unset
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Dependency guarding admin endpoints with a shared token"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled, set ADMIN_API_TOKEN to enable it")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+# Knowledge base configuration
+KNOWLEDGE_DOCUMENTS_PATH = os.environ.get(
+    "KNOWLEDGE_DOCUMENTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_documents.json")
+)
+
+# Retrieval query templates used by the analysis endpoints
+RETRIEVAL_TEMPLATES = {
+    "simplify": "explain nutrition label with {calories} calories",
+    "health_goal": "health goal {health_goal} nutrition suitability",
+    "diet_compatibility": "diet compatibility {diet_type} nutrition",
+    "warnings": "nutrition warnings health alerts {food_name}"
+}
+RETRIEVAL_MEMO_SIZE = int(os.environ.get("RETRIEVAL_MEMO_SIZE", "1024"))
+
+retrieval_stats = {
+    "precomputed_hits": 0,
+    "normalized_hits": 0,
+    "template_misses": 0,
+    "memo_hits": 0,
+    "memo_misses": 0
+}
+
+class KnowledgeBaseManager:
+    """Curated knowledge documents, re-indexed in the background
+    
+    Edits only touch the document set. A single background thread builds a
+    new index from a copy of it and swaps it into `rag_knowledge_base` with
+    one reference assignment, so readers never see a half-built index and
+    never wait on a lock. Edits made during a build trigger one more build.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.rebuild_requested = threading.Event()
+        self.thread = None  # The running rebuild thread, cleared under the lock when it exits
+
+        if os.path.exists(path):
+            with open(path) as documents_file:
+                for document in json.load(documents_file):
+                    self.documents[document["id"]] = document
+
+    def upsert(self, documents: List[KnowledgeDocument]) -> List[str]:
+        with self.lock:
+            ids = []
+            for document in documents:
+                record = document.model_dump()
+                record["id"] = record["id"] or uuid.uuid4().hex
+                self.documents[record["id"]] = record
+                ids.append(record["id"])
+            self._save()
+        self.request_rebuild()
+        return ids
+
+    def delete(self, ids: List[str]) -> List[str]:
+        with self.lock:
+            deleted = [document_id for document_id in ids if self.documents.pop(document_id, None) is not None]
+            if deleted:
+                self._save()
+        if deleted:
+            self.request_rebuild()
+        return deleted
+
+    def _save(self):
+        atomic_write_json(self.path, list(self.documents.values()))
+
+    def build(self) -> Dict[str, Any]:
+        """Build an index snapshot from a copy of the current documents"""
+        with self.lock:
+            documents = list(self.documents.values())
+        return create_rag_knowledge_base(documents)
+
+    def request_rebuild(self):
+        with self.lock:
+            self.rebuild_requested.set()
+            # self.thread is cleared under the same lock as the exit check,
+            # so a request is either seen by the running loop or starts a new one
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._rebuild_loop, name="knowledge-reindex", daemon=True)
+                self.thread.start()
+
+    def _rebuild_loop(self):
+        global rag_knowledge_base
+        
+        while True:
+            with self.lock:
+                if not self.rebuild_requested.is_set():
+                    self.thread = None
+                    return
+                self.rebuild_requested.clear()
+            try:
+                rag_knowledge_base = self.build()
+            except Exception as e:
+                print(f"Error rebuilding knowledge base: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        knowledge_base = rag_knowledge_base or {}
+        return {
+            "index_version": knowledge_base.get("version"),
+            "indexed_documents": len(knowledge_base.get("texts", [])),
+            "guideline_documents": knowledge_base.get("guideline_documents", 0),
+            "custom_documents": knowledge_base.get("custom_documents", 0),
+            "stored_documents": len(self.documents),
+            "build_seconds": knowledge_base.get("build_seconds"),
+            "built_at": knowledge_base.get("built_at"),
+            "building": self.thread is not None,
+            "retrieval": get_retrieval_stats()
+        }
+
+knowledge_documents = None
+
 def initialize_models():
     """Initialize LLM and embedding models"""
-    global llm_model, embedding_model, rag_knowledge_base
+    global llm_model, embedding_model, rag_knowledge_base, chat_sessions, food_catalog, knowledge_documents
+    
+    if chat_sessions is None:
+        chat_sessions = ChatSessionStore(
+            CHAT_SESSION_MAX_SESSIONS,
+            CHAT_SESSION_MAX_TURNS,
+            CHAT_SESSION_SUMMARY_MAX_CHARS,
+            CHAT_SESSION_STORE_PATH,
+            CHAT_SESSION_FLUSH_INTERVAL
+        )
+    
+    if food_catalog is None:
+        food_catalog = FoodCatalog(FOOD_CATALOG_PATH, FOOD_CATALOG_SEED_PATH)
+    
+    if knowledge_documents is None:
+        knowledge_documents = KnowledgeBaseManager(KNOWLEDGE_DOCUMENTS_PATH)
     
     try:
         print("Starting model initialization...")
@@ -123,7 +1157,7 @@ def initialize_models():
         
         # Create knowledge base embeddings
         print("Creating RAG knowledge base...")
-        rag_knowledge_base = create_rag_knowledge_base()
+        rag_knowledge_base = knowledge_documents.build()
         
         print("Models initialized successfully!")
         
@@ -133,8 +1167,9 @@ def initialize_models():
         llm_model = None
         embedding_model = None
 
-def create_rag_knowledge_base():
-    """Create embeddings for nutrition guidelines"""
+def create_rag_knowledge_base(documents: Optional[List[Dict[str, Any]]] = None):
+    """Create embeddings for nutrition guidelines and curated documents"""
+    started = time.perf_counter()
     knowledge_texts = []
     
     # Daily values information
@@ -149,30 +1184,136 @@ def create_rag_knowledge_base():
     for diet, info in NUTRITION_GUIDELINES["diet_compatibility"].items():
         knowledge_texts.append(f"For {diet} diet: {info['description']}")
     
+    guideline_documents = len(knowledge_texts)
+    
+    # Curated documents added through the admin API
+    for document in documents or []:
+        knowledge_texts.append(document["text"])
+    
+    lowered_texts = [text.lower() for text in knowledge_texts]
+    
+    # Precompute template results: full results for every known goal and diet,
+    # and the matches of each template's fixed words for everything else
+    template_values = {
+        "health_goal": ("health_goal", NUTRITION_GUIDELINES["health_goals"]),
+        "diet_compatibility": ("diet_type", NUTRITION_GUIDELINES["diet_compatibility"])
+    }
+    precomputed = {}
+    for template, (variable, known_values) in template_values.items():
+        for value in known_values:
+            query = RETRIEVAL_TEMPLATES[template].format(**{variable: value})
+            precomputed[(template, value)] = match_knowledge(lowered_texts, query.lower().split())
+    fixed_matches = {
+        template: match_knowledge(lowered_texts, re.sub(r"\{\w+\}", "", query).lower().split())
+        for template, query in RETRIEVAL_TEMPLATES.items()
+    }
+    
     # For now, return simple text-based knowledge base
-    return {"texts": knowledge_texts, "embeddings": None}
+    return {
+        "texts": knowledge_texts,
+        "lowered_texts": lowered_texts,
+        # Query words never contain whitespace, so a word matches some text iff it is in the corpus
+        "corpus": "\n".join(lowered_texts),
+        "precomputed": precomputed,
+        "fixed_matches": fixed_matches,
+        "memo": OrderedDict(),
+        "memo_lock": threading.Lock(),
+        "embeddings": None,
+        # Content hash, so every process serving the same documents agrees on it
+        "version": hashlib.sha256(json.dumps(knowledge_texts).encode()).hexdigest()[:16],
+        "guideline_documents": guideline_documents,
+        "custom_documents": len(knowledge_texts) - guideline_documents,
+        "built_at": time.time(),
+        "build_seconds": round(time.perf_counter() - started, 6)
+    }
+
+def match_knowledge(lowered_texts: List[str], query_words: List[str]) -> List[int]:
+    """Indices of the texts matching any query word"""
+    # Simple scoring based on keyword matches
+    return [index for index, text_lower in enumerate(lowered_texts) if any(word in text_lower for word in query_words)]
 
 def get_relevant_knowledge(query: str, top_k: int = 3):
     """Retrieve relevant knowledge using simple text matching"""
-    if not rag_knowledge_base:
+    # Read the snapshot once; a background rebuild may swap in a new one
+    knowledge_base = rag_knowledge_base
+    if not knowledge_base:
         return []
     
     # Simple keyword matching for now
-    relevant_texts = []
-    query_lower = query.lower()
+    texts = knowledge_base["texts"]
+    return [texts[index] for index in match_knowledge(knowledge_base["lowered_texts"], query.lower().split())[:top_k]]
+
+def get_template_knowledge(template: str, top_k: int = 3, **values):
+    """Retrieve knowledge for one of RETRIEVAL_TEMPLATES using index-time precomputation"""
+    knowledge_base = rag_knowledge_base
+    if not knowledge_base:
+        return []
+    texts = knowledge_base["texts"]
+    
+    if len(values) == 1:
+        indices = knowledge_base["precomputed"].get((template, str(next(iter(values.values())))))
+        if indices is not None:
+            retrieval_stats["precomputed_hits"] += 1
+            return [texts[index] for index in indices[:top_k]]
     
-    for text in rag_knowledge_base["texts"]:
-        # Simple scoring based on keyword matches
-        if any(word in text.lower() for word in query_lower.split()):
-            relevant_texts.append(text)
+    # When no variable word occurs anywhere, only the fixed words can match
+    variable_words = " ".join(str(value) for value in values.values()).lower().split()
+    if not any(word in knowledge_base["corpus"] for word in variable_words):
+        retrieval_stats["normalized_hits"] += 1
+        return [texts[index] for index in knowledge_base["fixed_matches"][template][:top_k]]
     
-    return relevant_texts[:top_k]
+    retrieval_stats["template_misses"] += 1
+    return get_relevant_knowledge(RETRIEVAL_TEMPLATES[template].format(**values), top_k)
+
+def get_cached_knowledge(query: str, top_k: int = 3):
+    """Retrieve knowledge for free-form questions through a bounded LRU memo"""
+    knowledge_base = rag_knowledge_base
+    if not knowledge_base:
+        return []
+    
+    # The memo lives in the snapshot, so an index swap starts it afresh
+    key = (" ".join(query.lower().split()), top_k)
+    memo = knowledge_base["memo"]
+    with knowledge_base["memo_lock"]:
+        if key in memo:
+            memo.move_to_end(key)
+            retrieval_stats["memo_hits"] += 1
+            return list(memo[key])
+    
+    retrieval_stats["memo_misses"] += 1
+    indices = match_knowledge(knowledge_base["lowered_texts"], key[0].split())[:top_k]
+    relevant_texts = [knowledge_base["texts"][index] for index in indices]
+    with knowledge_base["memo_lock"]:
+        memo[key] = relevant_texts
+        while len(memo) > RETRIEVAL_MEMO_SIZE:
+            memo.popitem(last=False)
+    return list(relevant_texts)
+
+def get_retrieval_stats() -> Dict[str, Any]:
+    stats = dict(retrieval_stats)
+    template_total = stats["precomputed_hits"] + stats["normalized_hits"] + stats["template_misses"]
+    memo_total = stats["memo_hits"] + stats["memo_misses"]
+    stats["template_hit_rate"] = round((template_total - stats["template_misses"]) / template_total, 3) if template_total else None
+    stats["memo_hit_rate"] = round(stats["memo_hits"] / memo_total, 3) if memo_total else None
+    stats["memo_size"] = len(rag_knowledge_base["memo"]) if rag_knowledge_base else 0
+    return stats
 
 def generate_llm_response(prompt: str, max_length: int = 200):
     """Generate response using rule-based system"""
     # For now, use enhanced rule-based responses
     return generate_rule_based_response(prompt)
 
+def generate_llm_response_stream(prompt: str, max_length: int = 200):
+    """Yield the response in sentence-sized chunks
+    
+    The rule-based generator returns the whole response at once, so it is
+    split after generation; a streaming model would yield tokens here.
+    """
+    response = generate_llm_response(prompt, max_length)
+    sentences = response.split(". ")
+    for index, sentence in enumerate(sentences):
+        yield sentence + (". " if index < len(sentences) - 1 else "")
+
 def generate_rule_based_response(prompt: str):
     """Enhanced rule-based response generation"""
     prompt_lower = prompt.lower()
@@ -227,7 +1368,25 @@ def generate_rule_based_response(prompt: str):
 @app.on_event("startup")
 async def startup_event():
     """Initialize models on startup"""
+    global batch_jobs, profile_store
+    
     initialize_models()
+    
+    profile_store = ProfileStore(PROFILE_DB_PATH, PROFILE_CACHE_SIZE)
+    
+    batch_jobs = BatchJobManager(BATCH_JOB_DB_PATH, BATCH_JOB_WORKERS, BATCH_JOB_CHUNK_SIZE, BATCH_JOB_LEASE_SECONDS)
+    resumed = batch_jobs.resume()
+    if resumed:
+        print(f"Resumed {resumed} unfinished batch jobs")
+    batch_jobs.start_reaper()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop batch workers and persist chat sessions; unfinished jobs resume on next startup"""
+    if batch_jobs:
+        batch_jobs.shutdown()
+    if chat_sessions:
+        chat_sessions.close()
 
 @app.get("/api/health")
 async def health_check():
@@ -235,275 +1394,559 @@ async def health_check():
     return {"status": "healthy", "models_loaded": llm_model is not None}
 
 @app.post("/api/nutrition/simplify")
-async def simplify_nutrition_label(nutrition: NutritionInput):
+async def simplify_nutrition_label(nutrition: NutritionInput, request: Request, http_response: Response, fields: Optional[str] = None, profile_id: Optional[str] = None):
     """Functionality 1: Nutritional Label Simplification"""
+    requested = parse_fields(fields, SIMPLIFY_FIELDS)
+    scorer = await resolve_scorer_async(profile_id)
+    etag = compute_analysis_etag("simplify", nutrition, {"fields": requested, "profile": scorer["fingerprint"]})
+    not_modified = check_not_modified(request, http_response, etag)
+    if not_modified:
+        return not_modified
+    
     try:
-        # Get relevant knowledge
-        query = f"explain nutrition label with {nutrition.calories} calories"
-        relevant_knowledge = get_relevant_knowledge(query)
-        
-        # Create prompt
-        prompt = f"""
-        Simplify this nutrition label for easy understanding:
-        
-        Food: {nutrition.food_name}
-        Serving Size: {nutrition.serving_size}
-        Calories: {nutrition.calories}
-        Total Fat: {nutrition.total_fat}g
-        Saturated Fat: {nutrition.saturated_fat}g
-        Cholesterol: {nutrition.cholesterol}mg
-        Sodium: {nutrition.sodium}mg
-        Total Carbohydrates: {nutrition.total_carbs}g
-        Dietary Fiber: {nutrition.dietary_fiber}g
-        Total Sugars: {nutrition.total_sugars}g
-        Added Sugars: {nutrition.added_sugars}g
-        Protein: {nutrition.protein}g
-        
-        Context: {' '.join(relevant_knowledge)}
-        
-        Provide a simple, friendly explanation of what these numbers mean:
-        """
-        
-        response = generate_llm_response(prompt)
+        def simplified_explanation():
+            # Get relevant knowledge
+            relevant_knowledge = get_template_knowledge("simplify", calories=nutrition.calories)
+            
+            # Create prompt
+            prompt = f"""
+            Simplify this nutrition label for easy understanding:
+            
+            Food: {nutrition.food_name}
+            Serving Size: {nutrition.serving_size}
+            Calories: {nutrition.calories}
+            Total Fat: {nutrition.total_fat}g
+            Saturated Fat: {nutrition.saturated_fat}g
+            Cholesterol: {nutrition.cholesterol}mg
+            Sodium: {nutrition.sodium}mg
+            Total Carbohydrates: {nutrition.total_carbs}g
+            Dietary Fiber: {nutrition.dietary_fiber}g
+            Total Sugars: {nutrition.total_sugars}g
+            Added Sugars: {nutrition.added_sugars}g
+            Protein: {nutrition.protein}g
+            
+            Context: {' '.join(relevant_knowledge)}
+            
+            Provide a simple, friendly explanation of what these numbers mean:
+            """
+            
+            return generate_llm_response(prompt)
         
-        # Calculate daily value percentages
-        daily_values = NUTRITION_GUIDELINES["daily_values"]
-        percentages = {}
-        for nutrient in ["calories", "total_fat", "saturated_fat", "cholesterol", "sodium", "total_carbs", "dietary_fiber", "protein"]:
-            if hasattr(nutrition, nutrient) and nutrient in daily_values:
-                value = getattr(nutrition, nutrient)
-                percentages[nutrient] = round((value / daily_values[nutrient]) * 100, 1)
+        def daily_value_percentages():
+            # Calculate daily value percentages
+            daily_values = scorer["daily_values"]
+            percentages = {}
+            for nutrient in ["calories", "total_fat", "saturated_fat", "cholesterol", "sodium", "total_carbs", "dietary_fiber", "protein"]:
+                if hasattr(nutrition, nutrient) and nutrient in daily_values:
+                    value = getattr(nutrition, nutrient)
+                    percentages[nutrient] = round((value / daily_values[nutrient]) * 100, 1)
+            return percentages
         
-        return {
-            "simplified_explanation": response,
-            "daily_value_percentages": percentages,
-            "key_insights": [
+        return evaluate_fields(requested, {
+            "simplified_explanation": simplified_explanation,
+            "daily_value_percentages": daily_value_percentages,
+            "key_insights": lambda: [
                 f"This serving contains {nutrition.calories} calories",
                 f"Provides {nutrition.protein}g of protein",
                 f"Contains {nutrition.total_fat}g of fat",
                 f"Has {nutrition.added_sugars}g of added sugars"
-            ]
-        }
+            ],
+            "percentiles": lambda: food_catalog.rank(nutrition)
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing nutrition label: {str(e)}")
 
 @app.post("/api/nutrition/health-goal")
-async def check_health_goal_suitability(goal_input: HealthGoalInput):
+async def check_health_goal_suitability(goal_input: HealthGoalInput, request: Request, http_response: Response, fields: Optional[str] = None, profile_id: Optional[str] = None):
     """Functionality 2: Health Goal Suitability"""
+    requested = parse_fields(fields, HEALTH_GOAL_FIELDS)
+    scorer = await resolve_scorer_async(profile_id)
+    etag = compute_analysis_etag("health-goal", goal_input.nutrition_data, {
+        "health_goal": goal_input.health_goal, "fields": requested, "profile": scorer["fingerprint"]
+    })
+    not_modified = check_not_modified(request, http_response, etag)
+    if not_modified:
+        return not_modified
+    
     try:
         nutrition = goal_input.nutrition_data
         health_goal = goal_input.health_goal
         
-        # Get relevant knowledge
-        query = f"health goal {health_goal} nutrition suitability"
-        relevant_knowledge = get_relevant_knowledge(query)
-        
         # Get goal-specific guidelines
         goal_info = NUTRITION_GUIDELINES["health_goals"].get(health_goal, {})
         
-        # Create prompt
-        prompt = f"""
-        Analyze if this food is suitable for the health goal: {health_goal}
-        
-        Nutrition Information:
-        Calories: {nutrition.calories}
-        Total Fat: {nutrition.total_fat}g
-        Saturated Fat: {nutrition.saturated_fat}g
-        Sodium: {nutrition.sodium}mg
-        Added Sugars: {nutrition.added_sugars}g
-        Protein: {nutrition.protein}g
-        Fiber: {nutrition.dietary_fiber}g
+        def suitability_verdict():
+            # Get relevant knowledge
+            relevant_knowledge = get_template_knowledge("health_goal", health_goal=health_goal)
+            
+            # Create prompt
+            prompt = f"""
+            Analyze if this food is suitable for the health goal: {health_goal}
+            
+            Nutrition Information:
+            Calories: {nutrition.calories}
+            Total Fat: {nutrition.total_fat}g
+            Saturated Fat: {nutrition.saturated_fat}g
+            Sodium: {nutrition.sodium}mg
+            Added Sugars: {nutrition.added_sugars}g
+            Protein: {nutrition.protein}g
+            Fiber: {nutrition.dietary_fiber}g
+            
+            Health Goal: {health_goal}
+            Goal Description: {goal_info.get('description', '')}
+            
+            Context: {' '.join(relevant_knowledge)}
+            
+            Provide a clear verdict on whether this food aligns with the health goal:
+            """
+            
+            return generate_llm_response(prompt)
         
-        Health Goal: {health_goal}
-        Goal Description: {goal_info.get('description', '')}
+        # Rule-based evaluation, shared by the score and the recommendation
+        suitability_score = functools.cache(lambda: calculate_health_goal_score(nutrition, health_goal, scorer["thresholds"]))
         
-        Context: {' '.join(relevant_knowledge)}
-        
-        Provide a clear verdict on whether this food aligns with the health goal:
-        """
-        
-        response = generate_llm_response(prompt)
-        
-        # Rule-based evaluation
-        suitability_score = calculate_health_goal_score(nutrition, health_goal)
-        
-        return {
-            "health_goal": health_goal,
-            "suitability_verdict": response,
+        return evaluate_fields(requested, {
+            "health_goal": lambda: health_goal,
+            "suitability_verdict": suitability_verdict,
             "suitability_score": suitability_score,
-            "recommendation": get_health_goal_recommendation(suitability_score),
-            "goal_info": goal_info
-        }
+            "recommendation": lambda: get_health_goal_recommendation(suitability_score()),
+            "goal_info": lambda: goal_info,
+            "percentiles": lambda: food_catalog.rank(nutrition)
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing health goal suitability: {str(e)}")
 
 @app.post("/api/nutrition/diet-compatibility")
-async def check_diet_compatibility(diet_input: DietCompatibilityInput):
+async def check_diet_compatibility(diet_input: DietCompatibilityInput, request: Request, http_response: Response, fields: Optional[str] = None, profile_id: Optional[str] = None):
     """Functionality 3: Diet Compatibility Checker"""
+    requested = parse_fields(fields, DIET_COMPATIBILITY_FIELDS)
+    scorer = await resolve_scorer_async(profile_id)
+    etag = compute_analysis_etag("diet-compatibility", diet_input.nutrition_data, {
+        "diet_type": diet_input.diet_type, "fields": requested, "profile": scorer["fingerprint"]
+    })
+    not_modified = check_not_modified(request, http_response, etag)
+    if not_modified:
+        return not_modified
+    
     try:
         nutrition = diet_input.nutrition_data
         diet_type = diet_input.diet_type
         
-        # Get relevant knowledge
-        query = f"diet compatibility {diet_type} nutrition"
-        relevant_knowledge = get_relevant_knowledge(query)
-        
         # Get diet-specific guidelines
         diet_info = NUTRITION_GUIDELINES["diet_compatibility"].get(diet_type, {})
         
-        # Create prompt
-        prompt = f"""
-        Check if this food is compatible with the {diet_type} diet:
+        def compatibility_explanation():
+            # Get relevant knowledge
+            relevant_knowledge = get_template_knowledge("diet_compatibility", diet_type=diet_type)
+            
+            # Create prompt
+            prompt = f"""
+            Check if this food is compatible with the {diet_type} diet:
+            
+            Nutrition Information:
+            Calories: {nutrition.calories}
+            Total Fat: {nutrition.total_fat}g
+            Total Carbs: {nutrition.total_carbs}g
+            Dietary Fiber: {nutrition.dietary_fiber}g
+            Protein: {nutrition.protein}g
+            Sodium: {nutrition.sodium}mg
+            Added Sugars: {nutrition.added_sugars}g
+            
+            Diet Type: {diet_type}
+            Diet Description: {diet_info.get('description', '')}
+            
+            Context: {' '.join(relevant_knowledge)}
+            
+            Explain the compatibility with reasoning:
+            """
+            
+            return generate_llm_response(prompt)
         
-        Nutrition Information:
-        Calories: {nutrition.calories}
-        Total Fat: {nutrition.total_fat}g
-        Total Carbs: {nutrition.total_carbs}g
-        Dietary Fiber: {nutrition.dietary_fiber}g
-        Protein: {nutrition.protein}g
-        Sodium: {nutrition.sodium}mg
-        Added Sugars: {nutrition.added_sugars}g
+        # Rule-based compatibility check, shared by the score and the verdict
+        compatibility_score = functools.cache(lambda: calculate_diet_compatibility_score(nutrition, diet_type))
         
-        Diet Type: {diet_type}
-        Diet Description: {diet_info.get('description', '')}
-        
-        Context: {' '.join(relevant_knowledge)}
-        
-        Explain the compatibility with reasoning:
-        """
-        
-        response = generate_llm_response(prompt)
-        
-        # Rule-based compatibility check
-        compatibility_score = calculate_diet_compatibility_score(nutrition, diet_type)
-        
-        return {
-            "diet_type": diet_type,
-            "compatibility_explanation": response,
+        return evaluate_fields(requested, {
+            "diet_type": lambda: diet_type,
+            "compatibility_explanation": compatibility_explanation,
             "compatibility_score": compatibility_score,
-            "is_compatible": compatibility_score >= 70,
-            "diet_info": diet_info,
-            "specific_concerns": get_diet_specific_concerns(nutrition, diet_type)
-        }
+            "is_compatible": lambda: compatibility_score() >= 70,
+            "diet_info": lambda: diet_info,
+            "specific_concerns": lambda: get_diet_specific_concerns(nutrition, diet_type),
+            "percentiles": lambda: food_catalog.rank(nutrition)
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error checking diet compatibility: {str(e)}")
 
+@app.post("/api/nutrition/chat/session")
+async def create_chat_session(session_input: ChatSessionInput):
+    """Create a server-side chat session so later turns only send the question"""
+    session_id = chat_sessions.create(session_input.nutrition_data.model_dump(), session_input.context)
+    return {"session_id": session_id}
+
+@app.delete("/api/nutrition/chat/session/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Discard a chat session"""
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"session_id": session_id, "deleted": True}
+
+@app.get("/api/nutrition/chat/stats")
+async def chat_session_stats():
+    """Chat session store statistics"""
+    return chat_sessions.stats()
+
+def start_chat_turn(nutrition_data: Optional[NutritionInput], session_id: Optional[str], question: str,
+                    context: str = "", start_session: bool = False):
+    """Resolve the chat session for a turn and build its prompt
+    
+    Without session_id or start_session the turn is stateless, as before sessions existed.
+    Session ids are only minted here: nutrition_data with a known session_id resets that
+    session, with an unknown one it starts a new session under a fresh id.
+    """
+    if nutrition_data is None and not session_id:
+        raise HTTPException(status_code=422, detail="nutrition_data or session_id is required")
+    
+    if nutrition_data is not None and not (session_id or start_session):
+        nutrition = nutrition_data
+    else:
+        if nutrition_data is not None:
+            # A fresh nutrition record starts the session; its context is stored with it
+            if not (session_id and chat_sessions.reset(session_id, nutrition_data.model_dump(), context)):
+                session_id = chat_sessions.create(nutrition_data.model_dump(), context)
+            context = ""
+        
+        session = chat_sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Chat session not found, resend nutrition_data")
+        nutrition = NutritionInput(**session["nutrition_data"])
+        context = " ".join(part for part in [context, chat_sessions.build_context(session)] if part)
+    
+    # Get relevant knowledge
+    relevant_knowledge = get_cached_knowledge(question)
+    
+    # Create prompt
+    prompt = f"""
+    Answer this question about the nutrition information:
+    
+    Question: {question}
+    
+    Nutrition Information:
+    Food: {nutrition.food_name}
+    Calories: {nutrition.calories}
+    Total Fat: {nutrition.total_fat}g
+    Saturated Fat: {nutrition.saturated_fat}g
+    Cholesterol: {nutrition.cholesterol}mg
+    Sodium: {nutrition.sodium}mg
+    Total Carbs: {nutrition.total_carbs}g
+    Dietary Fiber: {nutrition.dietary_fiber}g
+    Total Sugars: {nutrition.total_sugars}g
+    Added Sugars: {nutrition.added_sugars}g
+    Protein: {nutrition.protein}g
+    
+    Context: {context}
+    Knowledge: {' '.join(relevant_knowledge)}
+    
+    Provide a helpful, conversational answer:
+    """
+    
+    return session_id, prompt, relevant_knowledge
+
+def finish_chat_turn(session_id: Optional[str], question: str, answer: str, relevant_knowledge: List[str]) -> Dict[str, Any]:
+    """Record a chat turn and build the response body"""
+    if session_id:
+        chat_sessions.add_turn(session_id, question, answer)
+    
+    return {
+        "session_id": session_id,
+        "question": question,
+        "answer": answer,
+        "relevant_facts": relevant_knowledge[:2],
+        "follow_up_suggestions": [
+            "How does this compare to daily recommended values?",
+            "What are the health implications of these nutrients?",
+            "Are there any concerns with this food item?"
+        ]
+    }
+
 @app.post("/api/nutrition/chat")
 async def conversational_assistant(chat_input: ConversationalInput):
     """Functionality 4: Conversational Query Assistant"""
     try:
-        nutrition = chat_input.nutrition_data
-        question = chat_input.question
-        context = chat_input.context
-        
-        # Get relevant knowledge
-        relevant_knowledge = get_relevant_knowledge(question)
-        
-        # Create prompt
-        prompt = f"""
-        Answer this question about the nutrition information:
-        
-        Question: {question}
-        
-        Nutrition Information:
-        Food: {nutrition.food_name}
-        Calories: {nutrition.calories}
-        Total Fat: {nutrition.total_fat}g
-        Saturated Fat: {nutrition.saturated_fat}g
-        Cholesterol: {nutrition.cholesterol}mg
-        Sodium: {nutrition.sodium}mg
-        Total Carbs: {nutrition.total_carbs}g
-        Dietary Fiber: {nutrition.dietary_fiber}g
-        Total Sugars: {nutrition.total_sugars}g
-        Added Sugars: {nutrition.added_sugars}g
-        Protein: {nutrition.protein}g
-        
-        Context: {context}
-        Knowledge: {' '.join(relevant_knowledge)}
-        
-        Provide a helpful, conversational answer:
-        """
-        
+        session_id, prompt, relevant_knowledge = start_chat_turn(
+            chat_input.nutrition_data, chat_input.session_id, chat_input.question, chat_input.context,
+            chat_input.start_session
+        )
         response = generate_llm_response(prompt)
+        return finish_chat_turn(session_id, chat_input.question, response, relevant_knowledge)
         
-        return {
-            "question": question,
-            "answer": response,
-            "relevant_facts": relevant_knowledge[:2],
-            "follow_up_suggestions": [
-                "How does this compare to daily recommended values?",
-                "What are the health implications of these nutrients?",
-                "Are there any concerns with this food item?"
-            ]
-        }
-        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in conversational assistant: {str(e)}")
 
+@app.websocket("/api/nutrition/chat/ws")
+async def conversational_assistant_ws(websocket: WebSocket, session_id: Optional[str] = None):
+    """Functionality 4 over a WebSocket: one connection per conversation
+    
+    Client messages: {"question": "...", "nutrition_data": {...}?, "context": "..."?}
+    Server messages: {"type": "session"}, {"type": "chunk"} per partial answer,
+    {"type": "answer"} with the full chat response, or {"type": "error"}.
+    """
+    await websocket.accept()
+    pending: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(maxsize=CHAT_WS_MAX_PENDING)
+    
+    async def receive_questions():
+        try:
+            while True:
+                try:
+                    text = await asyncio.wait_for(websocket.receive_text(), timeout=CHAT_WS_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    await websocket.close(code=1000, reason="Idle timeout")
+                    break
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    await websocket.send_json({"type": "error", "detail": "Messages must be JSON"})
+                    continue
+                if pending.full():
+                    # Back-pressure: questions sent while an answer is being generated wait
+                    # here; beyond the limit they are refused rather than buffered without bound
+                    await websocket.send_json({"type": "error", "detail": "Too many pending questions"})
+                    continue
+                await pending.put(message)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            await pending.put(None)
+    
+    receiver = asyncio.create_task(receive_questions())
+    try:
+        if session_id and chat_sessions.get(session_id) is not None:
+            await websocket.send_json({"type": "session", "session_id": session_id})
+        
+        while True:
+            message = await pending.get()
+            if message is None:
+                break
+            try:
+                chat_input = ConversationalInput(**{"session_id": session_id, **message})
+                # A WebSocket is one conversation, so it always keeps a session
+                session_id, prompt, relevant_knowledge = start_chat_turn(
+                    chat_input.nutrition_data, chat_input.session_id, chat_input.question, chat_input.context,
+                    start_session=True
+                )
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": e.detail})
+                continue
+            except Exception as e:
+                await websocket.send_json({"type": "error", "detail": f"Invalid chat message: {str(e)}"})
+                continue
+            
+            # Each chunk is generated in a worker thread and sent as soon as it is ready,
+            # so the loop keeps serving other connections and this one's receiver
+            chunks = []
+            stream = generate_llm_response_stream(prompt)
+            while True:
+                chunk = await asyncio.to_thread(next, stream, None)
+                if chunk is None:
+                    break
+                chunks.append(chunk)
+                await websocket.send_json({"type": "chunk", "session_id": session_id, "delta": chunk})
+            
+            result = finish_chat_turn(session_id, chat_input.question, "".join(chunks), relevant_knowledge)
+            await websocket.send_json({"type": "answer", **result})
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the receiver closed the socket on idle timeout mid-answer
+        pass
+    finally:
+        receiver.cancel()
+
 @app.post("/api/nutrition/warnings")
-async def generate_warnings_and_suggestions(nutrition: NutritionInput):
+async def generate_warnings_and_suggestions(nutrition: NutritionInput, request: Request, http_response: Response, fields: Optional[str] = None, profile_id: Optional[str] = None):
     """Functionality 5: Smart Warnings and Suggestions"""
+    requested = parse_fields(fields, WARNINGS_FIELDS)
+    scorer = await resolve_scorer_async(profile_id)
+    etag = compute_analysis_etag("warnings", nutrition, {"fields": requested, "profile": scorer["fingerprint"]})
+    not_modified = check_not_modified(request, http_response, etag)
+    if not_modified:
+        return not_modified
+    
     try:
-        # Get relevant knowledge
-        query = f"nutrition warnings health alerts {nutrition.food_name}"
-        relevant_knowledge = get_relevant_knowledge(query)
-        
-        # Create prompt
-        prompt = f"""
-        Analyze this nutrition label for health warnings and provide suggestions:
-        
-        Food: {nutrition.food_name}
-        Calories: {nutrition.calories}
-        Total Fat: {nutrition.total_fat}g
-        Saturated Fat: {nutrition.saturated_fat}g
-        Sodium: {nutrition.sodium}mg
-        Added Sugars: {nutrition.added_sugars}g
-        Protein: {nutrition.protein}g
-        
-        Context: {' '.join(relevant_knowledge)}
-        
-        Provide health warnings and alternative suggestions:
-        """
-        
-        response = generate_llm_response(prompt)
+        def ai_analysis():
+            # Get relevant knowledge
+            relevant_knowledge = get_template_knowledge("warnings", food_name=nutrition.food_name)
+            
+            # Create prompt
+            prompt = f"""
+            Analyze this nutrition label for health warnings and provide suggestions:
+            
+            Food: {nutrition.food_name}
+            Calories: {nutrition.calories}
+            Total Fat: {nutrition.total_fat}g
+            Saturated Fat: {nutrition.saturated_fat}g
+            Sodium: {nutrition.sodium}mg
+            Added Sugars: {nutrition.added_sugars}g
+            Protein: {nutrition.protein}g
+            
+            Context: {' '.join(relevant_knowledge)}
+            
+            Provide health warnings and alternative suggestions:
+            """
+            
+            return generate_llm_response(prompt)
         
         # Rule-based warnings
-        warnings = generate_health_warnings(nutrition)
-        suggestions = generate_healthy_alternatives(nutrition)
-        
-        return {
-            "ai_analysis": response,
-            "health_warnings": warnings,
-            "alternative_suggestions": suggestions,
-            "overall_health_score": calculate_overall_health_score(nutrition),
-            "improvement_tips": get_improvement_tips(nutrition)
-        }
+        return evaluate_fields(requested, {
+            "ai_analysis": ai_analysis,
+            "health_warnings": lambda: generate_health_warnings(nutrition, scorer["thresholds"]),
+            "alternative_suggestions": lambda: generate_healthy_alternatives(nutrition),
+            "overall_health_score": lambda: calculate_overall_health_score(nutrition, scorer["thresholds"]),
+            "improvement_tips": lambda: get_improvement_tips(nutrition),
+            "percentiles": lambda: food_catalog.rank(nutrition)
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating warnings: {str(e)}")
 
+@app.get("/api/nutrition/catalog/stats")
+async def food_catalog_stats():
+    """Food catalog size per category"""
+    return food_catalog.stats()
+
+@app.post("/api/nutrition/catalog", dependencies=[Depends(require_admin_token)])
+async def upsert_catalog_foods(foods: List[CatalogFood]):
+    """Add or update catalog foods used for percentile ranking"""
+    ids = await asyncio.to_thread(food_catalog.upsert, foods)
+    return {"ids": ids, "version": food_catalog.version}
+
+@app.delete("/api/nutrition/catalog/{food_id}", dependencies=[Depends(require_admin_token)])
+async def delete_catalog_food(food_id: str):
+    """Remove a food from the catalog"""
+    if not await asyncio.to_thread(food_catalog.remove, food_id):
+        raise HTTPException(status_code=404, detail="Catalog food not found")
+    return {"id": food_id, "deleted": True, "version": food_catalog.version}
+
+@app.get("/api/admin/knowledge/stats", dependencies=[Depends(require_admin_token)])
+async def knowledge_base_stats():
+    """Knowledge index version, document counts and last build time"""
+    return knowledge_documents.stats()
+
+@app.post("/api/admin/knowledge", status_code=202, dependencies=[Depends(require_admin_token)])
+async def upsert_knowledge_documents(documents: List[KnowledgeDocument]):
+    """Add or update knowledge documents in bulk; the index rebuilds in the background"""
+    if not documents:
+        raise HTTPException(status_code=400, detail="No documents given")
+    ids = await asyncio.to_thread(knowledge_documents.upsert, documents)
+    return {"ids": ids, "reindexing": True, **knowledge_documents.stats()}
+
+@app.post("/api/admin/knowledge/delete", status_code=202, dependencies=[Depends(require_admin_token)])
+async def delete_knowledge_documents(delete_input: KnowledgeDeleteInput):
+    """Delete knowledge documents in bulk; the index rebuilds in the background"""
+    deleted = await asyncio.to_thread(knowledge_documents.delete, delete_input.ids)
+    return {"deleted": deleted, "reindexing": bool(deleted), **knowledge_documents.stats()}
+
+def validate_profile(profile: NutritionProfileInput):
+    if profile.activity_level not in ACTIVITY_FACTORS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown activity_level. Available: {', '.join(ACTIVITY_FACTORS)}"
+        )
+    if not 2 <= profile.age <= 120 or profile.weight_kg <= 0:
+        raise HTTPException(status_code=400, detail="age must be 2-120 and weight_kg positive")
+
+@app.post("/api/profiles", status_code=201)
+async def create_profile(profile: NutritionProfileInput):
+    """Create a nutrition profile; pass its profile_id to the analysis endpoints"""
+    validate_profile(profile)
+    profile_id = await asyncio.to_thread(profile_store.save, profile)
+    return {"profile_id": profile_id, "profile": profile, "daily_values": derive_personal_daily_values(profile)}
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """A nutrition profile with its personalized daily values"""
+    profile = await asyncio.to_thread(profile_store.load, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Nutrition profile not found")
+    return {"profile_id": profile_id, "profile": profile, "daily_values": derive_personal_daily_values(profile)}
+
+@app.put("/api/profiles/{profile_id}")
+async def update_profile(profile_id: str, profile: NutritionProfileInput):
+    """Replace a nutrition profile; its compiled scorer is rebuilt on next use"""
+    validate_profile(profile)
+    if await asyncio.to_thread(profile_store.load, profile_id) is None:
+        raise HTTPException(status_code=404, detail="Nutrition profile not found")
+    await asyncio.to_thread(profile_store.save, profile, profile_id)
+    return {"profile_id": profile_id, "profile": profile, "daily_values": derive_personal_daily_values(profile)}
+
+@app.delete("/api/profiles/{profile_id}")
+async def delete_profile(profile_id: str):
+    """Delete a nutrition profile"""
+    if not await asyncio.to_thread(profile_store.delete, profile_id):
+        raise HTTPException(status_code=404, detail="Nutrition profile not found")
+    return {"profile_id": profile_id, "deleted": True}
+
+@app.post("/api/nutrition/jobs", status_code=202)
+async def submit_batch_job(job_input: BatchJobInput):
+    """Submit a dataset of nutrition records for background analysis"""
+    if not job_input.records:
+        raise HTTPException(status_code=400, detail="No records to analyze")
+    if len(job_input.records) > BATCH_JOB_MAX_RECORDS:
+        raise HTTPException(status_code=413, detail=f"Too many records, the limit is {BATCH_JOB_MAX_RECORDS}")
+    
+    await resolve_scorer_async(job_input.profile_id)
+    params = {"health_goal": job_input.health_goal, "diet_type": job_input.diet_type, "profile_id": job_input.profile_id}
+    job_id = await asyncio.to_thread(batch_jobs.submit, job_input.records, params)
+    return {"job_id": job_id, "status": "queued", "total": len(job_input.records)}
+
+@app.get("/api/nutrition/jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """Batch job status and progress"""
+    job = await asyncio.to_thread(batch_jobs.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+@app.get("/api/nutrition/jobs/{job_id}/results")
+async def get_batch_job_results(job_id: str, offset: int = 0, limit: int = 100):
+    """Page through the results finished so far"""
+    job = await asyncio.to_thread(batch_jobs.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    
+    limit = min(max(limit, 1), 1000)
+    results = await asyncio.to_thread(batch_jobs.results, job_id, max(offset, 0), limit)
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "total": job["total"],
+        "offset": offset,
+        "limit": limit,
+        "results": results
+    }
+
 # Helper functions
-def calculate_health_goal_score(nutrition: NutritionInput, health_goal: str) -> int:
+def calculate_health_goal_score(nutrition: NutritionInput, health_goal: str, thresholds: Optional[Dict[str, float]] = None) -> int:
     """Calculate suitability score for health goals"""
     score = 50  # Base score
+    thresholds = thresholds or GLOBAL_SCORER["thresholds"]
     
     if health_goal == "weight_loss":
-        if nutrition.calories < 300: score += 20
-        if nutrition.total_fat < 10: score += 15
-        if nutrition.added_sugars < 5: score += 15
+        if nutrition.calories < thresholds["weight_loss_max_calories"]: score += 20
+        if nutrition.total_fat < thresholds["weight_loss_max_fat"]: score += 15
+        if nutrition.added_sugars < thresholds["weight_loss_max_added_sugars"]: score += 15
     elif health_goal == "muscle_gain":
-        if nutrition.protein > 15: score += 25
-        if nutrition.calories > 200: score += 15
+        if nutrition.protein > thresholds["muscle_gain_min_protein"]: score += 25
+        if nutrition.calories > thresholds["muscle_gain_min_calories"]: score += 15
     elif health_goal == "heart_health":
-        if nutrition.sodium < 400: score += 20
-        if nutrition.saturated_fat < 3: score += 20
-        if nutrition.dietary_fiber > 5: score += 10
+        if nutrition.sodium < thresholds["heart_health_max_sodium"]: score += 20
+        if nutrition.saturated_fat < thresholds["heart_health_max_saturated_fat"]: score += 20
+        if nutrition.dietary_fiber > thresholds["heart_health_min_fiber"]: score += 10
     elif health_goal == "diabetes_management":
-        if nutrition.added_sugars < 3: score += 25
-        if nutrition.dietary_fiber > 5: score += 15
+        if nutrition.added_sugars < thresholds["diabetes_max_added_sugars"]: score += 25
+        if nutrition.dietary_fiber > thresholds["diabetes_min_fiber"]: score += 15
     
     return min(100, max(0, score))
 
@@ -524,19 +1967,19 @@ def calculate_diet_compatibility_score(nutrition: NutritionInput, diet_type: str
     
     return min(100, max(0, score))
 
-def calculate_overall_health_score(nutrition: NutritionInput) -> int:
+def calculate_overall_health_score(nutrition: NutritionInput, thresholds: Optional[Dict[str, float]] = None) -> int:
     """Calculate overall health score"""
     score = 50
-    daily_values = NUTRITION_GUIDELINES["daily_values"]
+    thresholds = thresholds or GLOBAL_SCORER["thresholds"]
     
     # Positive factors
-    if nutrition.dietary_fiber > 5: score += 15
-    if nutrition.protein > 10: score += 10
+    if nutrition.dietary_fiber > thresholds["overall_min_fiber"]: score += 15
+    if nutrition.protein > thresholds["overall_min_protein"]: score += 10
     
     # Negative factors
-    if nutrition.added_sugars > daily_values["added_sugars"] * 0.2: score -= 15
-    if nutrition.sodium > daily_values["sodium"] * 0.3: score -= 15
-    if nutrition.saturated_fat > daily_values["saturated_fat"] * 0.3: score -= 10
+    if nutrition.added_sugars > thresholds["overall_max_added_sugars"]: score -= 15
+    if nutrition.sodium > thresholds["overall_max_sodium"]: score -= 15
+    if nutrition.saturated_fat > thresholds["overall_max_saturated_fat"]: score -= 10
     
     return min(100, max(0, score))
 
@@ -561,18 +2004,18 @@ def get_diet_specific_concerns(nutrition: NutritionInput, diet_type: str) -> Lis
     
     return concerns
 
-def generate_health_warnings(nutrition: NutritionInput) -> List[str]:
+def generate_health_warnings(nutrition: NutritionInput, thresholds: Optional[Dict[str, float]] = None) -> List[str]:
     """Generate health warnings based on nutrition values"""
     warnings = []
-    daily_values = NUTRITION_GUIDELINES["daily_values"]
+    thresholds = thresholds or GLOBAL_SCORER["thresholds"]
     
-    if nutrition.sodium > daily_values["sodium"] * 0.4:
+    if nutrition.sodium > thresholds["warning_max_sodium"]:
         warnings.append("⚠️ High sodium content - may affect blood pressure")
-    if nutrition.added_sugars > daily_values["added_sugars"] * 0.3:
+    if nutrition.added_sugars > thresholds["warning_max_added_sugars"]:
         warnings.append("⚠️ High added sugars - may cause blood sugar spikes")
-    if nutrition.saturated_fat > daily_values["saturated_fat"] * 0.4:
+    if nutrition.saturated_fat > thresholds["warning_max_saturated_fat"]:
         warnings.append("⚠️ High saturated fat - may impact heart health")
-    if nutrition.calories > 500:
+    if nutrition.calories > thresholds["warning_max_calories"]:
         warnings.append("⚠️ High calorie content - consume in moderation")
     
     return warnings
@@ -605,6 +2048,23 @@ def get_improvement_tips(nutrition: NutritionInput) -> List[str]:
     
     return tips
 
+def analyze_batch_record(nutrition: NutritionInput, health_goal: Optional[str] = None, diet_type: Optional[str] = None, profile_id: Optional[str] = None) -> Dict[str, Any]:
+    """Rule-based analysis of one batch record (no LLM calls)"""
+    thresholds = resolve_scorer(profile_id)["thresholds"]
+    result = {
+        "food_name": nutrition.food_name,
+        "overall_health_score": calculate_overall_health_score(nutrition, thresholds),
+        "health_warnings": generate_health_warnings(nutrition, thresholds),
+        "alternative_suggestions": generate_healthy_alternatives(nutrition),
+        "improvement_tips": get_improvement_tips(nutrition)
+    }
+    if health_goal:
+        result["suitability_score"] = calculate_health_goal_score(nutrition, health_goal, thresholds)
+    if diet_type:
+        result["compatibility_score"] = calculate_diet_compatibility_score(nutrition, diet_type)
+        result["specific_concerns"] = get_diet_specific_concerns(nutrition, diet_type)
+    return result
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+# Dev dependencies, see requirements-dev.txt
+import httpx
+import websockets
+
+SAMPLE_NUTRITION_DATA = {
+    "food_name": "Greek Yogurt",
+    "calories": 150,
+    "total_fat": 8,
+    "saturated_fat": 5,
+    "trans_fat": 0,
+    "cholesterol": 20,
+    "sodium": 100,
+    "total_carbs": 10,
+    "dietary_fiber": 0,
+    "total_sugars": 10,
+    "added_sugars": 8,
+    "protein": 15,
+    "serving_size": "1 cup"
+}
+
+QUESTIONS = [
+    "Is this food healthy?",
+    "How much protein does this have?",
+    "What about sodium?",
+    "Is the sugar content a concern?",
+    "How much fat is in this?"
+]
+
+def server_cpu_seconds(pid):
+    """User + system CPU time of a process, read from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port):
+    """Run the backend in a child process so its CPU time can be measured"""
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health").status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Backend did not start")
+
+async def rest_conversation(client, base_url, turns, latencies):
+    """One conversation over REST, resending the full payload every turn as the old client did"""
+    context = ""
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        started = time.perf_counter()
+        response = await client.post(f"{base_url}/api/nutrition/chat", json={
+            "nutrition_data": SAMPLE_NUTRITION_DATA,
+            "question": question,
+            "context": context
+        })
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        context += f" Q: {question} A: {response.json()['answer']}"
+
+async def ws_conversation(ws_url, turns, latencies):
+    """One conversation over a single WebSocket, sending only new questions"""
+    async with websockets.connect(f"{ws_url}/api/nutrition/chat/ws") as websocket:
+        for turn in range(turns):
+            message = {"question": QUESTIONS[turn % len(QUESTIONS)]}
+            if turn == 0:
+                message["nutrition_data"] = SAMPLE_NUTRITION_DATA
+            started = time.perf_counter()
+            await websocket.send(json.dumps(message))
+            while True:
+                reply = json.loads(await websocket.recv())
+                if reply["type"] == "answer":
+                    break
+                if reply["type"] == "error":
+                    raise RuntimeError(reply["detail"])
+            latencies.append(time.perf_counter() - started)
+
+async def run_transport(name, base_url, conversations, turns, server_pid):
+    latencies = []
+    cpu_before = server_cpu_seconds(server_pid) if server_pid else None
+    started = time.perf_counter()
+
+    if name == "rest":
+        limits = httpx.Limits(max_connections=conversations)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            await asyncio.gather(*[rest_conversation(client, base_url, turns, latencies) for _ in range(conversations)])
+    else:
+        ws_url = base_url.replace("http://", "ws://").replace("https://", "wss://")
+        await asyncio.gather(*[ws_conversation(ws_url, turns, latencies) for _ in range(conversations)])
+
+    elapsed = time.perf_counter() - started
+    cpu_after = server_cpu_seconds(server_pid) if server_pid else None
+    latencies.sort()
+    return {
+        "transport": name,
+        "turns": len(latencies),
+        "wall_seconds": round(elapsed, 3),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "server_cpu_ms_per_turn": (
+            round((cpu_after - cpu_before) * 1000 / len(latencies), 3)
+            if cpu_before is not None and cpu_after is not None else None
+        )
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chat latency and server CPU for REST vs WebSocket")
+    parser.add_argument("--url", help="Benchmark an already running backend instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID of the running backend, for CPU measurement")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        base_url, server_pid = args.url.rstrip("/"), args.server_pid
+    else:
+        port = free_port()
+        process = start_server(port)
+        base_url, server_pid = f"http://127.0.0.1:{port}", process.pid
+
+    try:
+        print(f"📈 {args.conversations} concurrent conversations x {args.turns} turns against {base_url}")
+        for transport in ["rest", "ws"]:
+            result = asyncio.run(run_transport(transport, base_url, args.conversations, args.turns, server_pid))
+            print(json.dumps(result))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import statistics
+import time
+
+# Dev dependencies, see requirements-dev.txt
+import httpx
+
+from backend_chat_benchmark import SAMPLE_NUTRITION_DATA, free_port, start_server
+
+PROFILE = {"age": 70, "weight_kg": 60, "activity_level": "sedentary", "sex": "female"}
+
+def time_requests(client, url, requests):
+    """Latencies of sequential warnings requests; the payload varies so no response is a 304"""
+    latencies = []
+    for index in range(requests):
+        data = {**SAMPLE_NUTRITION_DATA, "sodium": index}
+        started = time.perf_counter()
+        client.post(url, json=data).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+def summarize(name, latencies):
+    latencies.sort()
+    return {
+        "scorer": name,
+        "requests": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare analysis latency with a cached profile scorer vs the global one")
+    parser.add_argument("--url", help="Benchmark an already running backend instead of starting one")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        port = free_port()
+        process = start_server(port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            profile_id = client.post("/api/profiles", json=PROFILE).json()["profile_id"]
+            fields = "fields=overall_health_score,health_warnings"
+            # Warm both paths, compiling and caching the profile's scorer
+            time_requests(client, f"/api/nutrition/warnings?{fields}&profile_id={profile_id}", 50)
+            time_requests(client, f"/api/nutrition/warnings?{fields}", 50)
+            
+            print(f"📈 {args.requests} sequential warnings requests per scorer against {base_url}")
+            urls = {
+                "global": f"/api/nutrition/warnings?{fields}",
+                "profile_cached": f"/api/nutrition/warnings?{fields}&profile_id={profile_id}"
+            }
+            # Alternate the paths in rounds so drift over the run affects both alike
+            latencies = {name: [] for name in urls}
+            for _ in range(args.rounds):
+                for name, url in urls.items():
+                    latencies[name] += time_requests(client, url, args.requests // args.rounds)
+            for name in urls:
+                print(json.dumps(summarize(name, latencies[name])))
+            client.delete(f"/api/profiles/{profile_id}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 import requests
 import json
+from websockets.sync.client import connect as websocket_connect
 import sys
 import os
+import time
 
 class NutritionAPITester:
     def __init__(self, base_url="https://92e8a57e-565c-476f-a61a-306ae44bc398.preview.emergentagent.com"):
         self.base_url = base_url
         self.tests_run = 0
         self.tests_passed = 0
+        self.last_headers = {}
+        self.admin_headers = {'X-Admin-Token': os.environ.get('ADMIN_API_TOKEN', '')}
         self.sample_nutrition_data = {
             "food_name": "Greek Yogurt",
             "calories": 150,
@@ -28,10 +32,10 @@ class NutritionAPITester:
             "serving_size": "1 cup"
         }
 
-    def run_test(self, name, method, endpoint, expected_status, data=None):
+    def run_test(self, name, method, endpoint, expected_status, data=None, extra_headers=None):
         """Run a single API test"""
         url = f"{self.base_url}/api/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(extra_headers or {})}
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -41,11 +45,16 @@ class NutritionAPITester:
                 response = requests.get(url, headers=headers)
             elif method == 'POST':
                 response = requests.post(url, json=data, headers=headers)
+            elif method == 'DELETE':
+                response = requests.delete(url, headers=headers)
 
             success = response.status_code == expected_status
             if success:
                 self.tests_passed += 1
                 print(f"✅ Passed - Status: {response.status_code}")
+                if response.status_code == 304:
+                    return success, {}
+                self.last_headers = response.headers
                 return success, response.json()
             else:
                 print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
@@ -155,8 +164,114 @@ class NutritionAPITester:
                 print(f"Question: {response.get('question')}")
                 print(f"Answer: {response.get('answer')}")
                 print(f"Follow-up suggestions: {json.dumps(response.get('follow_up_suggestions', []), indent=2)}")
+                # Requests without session_id or start_session stay stateless
+                success = response.get('session_id') is None
         return success
 
+    def test_chat_session_endpoint(self):
+        """Test multi-turn chat using a server-side session"""
+        success, response = self.run_test(
+            "Chat Session - first turn",
+            "POST",
+            "nutrition/chat",
+            200,
+            data={
+                "nutrition_data": self.sample_nutrition_data,
+                "question": "How much protein does this have?",
+                "start_session": True
+            }
+        )
+        if not success:
+            return False
+        session_id = response.get('session_id')
+        print(f"Session ID: {session_id}")
+        if not session_id:
+            return False
+        
+        success, response = self.run_test(
+            "Chat Session - follow-up without nutrition data",
+            "POST",
+            "nutrition/chat",
+            200,
+            data={
+                "session_id": session_id,
+                "question": "What about sodium?"
+            }
+        )
+        if success:
+            print(f"Answer: {response.get('answer')}")
+        
+        unknown_success, _ = self.run_test(
+            "Chat Session - unknown session",
+            "POST",
+            "nutrition/chat",
+            404,
+            data={
+                "session_id": "does-not-exist",
+                "question": "What about sodium?"
+            }
+        )
+        
+        # Ids are only minted by the server, never taken from the client
+        minted_success, response = self.run_test(
+            "Chat Session - client-chosen id is not used",
+            "POST",
+            "nutrition/chat",
+            200,
+            data={
+                "nutrition_data": self.sample_nutrition_data,
+                "session_id": "client-chosen-id",
+                "question": "Is this food healthy?"
+            }
+        )
+        minted_success = minted_success and response.get('session_id') not in (None, "client-chosen-id")
+        
+        missing_success, _ = self.run_test(
+            "Chat Session - neither nutrition data nor session",
+            "POST",
+            "nutrition/chat",
+            422,
+            data={"question": "What about sodium?"}
+        )
+        return success and unknown_success and minted_success and missing_success
+
+    def test_chat_websocket(self):
+        """Test multi-turn chat over the WebSocket endpoint"""
+        ws_url = self.base_url.replace("http://", "ws://").replace("https://", "wss://")
+        self.tests_run += 1
+        print("\n🔍 Testing Chat WebSocket...")
+        
+        try:
+            with websocket_connect(f"{ws_url}/api/nutrition/chat/ws") as websocket:
+                answers = []
+                for index, question in enumerate(["How much protein does this have?", "What about sodium?"]):
+                    message = {"question": question}
+                    if index == 0:
+                        message["nutrition_data"] = self.sample_nutrition_data
+                    websocket.send(json.dumps(message))
+                    chunks = []
+                    while True:
+                        reply = json.loads(websocket.recv(timeout=10))
+                        if reply["type"] == "chunk":
+                            chunks.append(reply["delta"])
+                        elif reply["type"] == "answer":
+                            break
+                        else:
+                            raise RuntimeError(reply.get("detail"))
+                    if "".join(chunks) != reply["answer"]:
+                        raise RuntimeError("Chunks do not add up to the answer")
+                    answers.append(reply)
+                
+                if not answers[0]["session_id"] or answers[0]["session_id"] != answers[1]["session_id"]:
+                    raise RuntimeError("Turns did not share a session")
+            
+            self.tests_passed += 1
+            print(f"✅ Passed - Answer: {answers[-1]['answer']}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
     def test_warnings_endpoint(self):
         """Test the warnings and suggestions endpoint"""
         success, response = self.run_test(
@@ -173,6 +288,239 @@ class NutritionAPITester:
             print(f"Overall health score: {response.get('overall_health_score')}")
         return success
 
+    def test_field_selection(self):
+        """Test that only the requested fields are returned"""
+        success, response = self.run_test(
+            "Warnings - score only",
+            "POST",
+            "nutrition/warnings?fields=overall_health_score",
+            200,
+            data=self.sample_nutrition_data
+        )
+        if success:
+            print(f"Response: {json.dumps(response)}")
+            success = list(response.keys()) == ["overall_health_score"]
+        return success
+
+    def test_batch_job(self):
+        """Test submitting a batch job and fetching its results"""
+        records = [{**self.sample_nutrition_data, "sodium": sodium} for sodium in range(0, 1500, 50)]
+        success, response = self.run_test(
+            "Batch Job - submit",
+            "POST",
+            "nutrition/jobs",
+            202,
+            data={"records": records, "health_goal": "heart_health"}
+        )
+        if not success:
+            return False
+        job_id = response.get('job_id')
+        
+        for _ in range(30):
+            success, response = self.run_test("Batch Job - status", "GET", f"nutrition/jobs/{job_id}", 200)
+            if not success or response.get('status') in ("completed", "failed"):
+                break
+            time.sleep(1)
+        print(f"Job status: {response.get('status')} ({response.get('processed')}/{response.get('total')})")
+        
+        success, response = self.run_test(
+            "Batch Job - results",
+            "GET",
+            f"nutrition/jobs/{job_id}/results?offset=0&limit=10",
+            200
+        )
+        if success:
+            print(f"First result: {json.dumps(response.get('results', [])[:1], indent=2)}")
+            success = len(response.get('results', [])) == 10
+        return success
+
+    def test_profile_scoring(self):
+        """Test scoring against a personalized nutrition profile"""
+        success, response = self.run_test(
+            "Profile - create",
+            "POST",
+            "profiles",
+            201,
+            data={"age": 70, "weight_kg": 60, "activity_level": "sedentary", "sex": "female"}
+        )
+        if not success:
+            return False
+        profile_id = response.get('profile_id')
+        print(f"Personal daily values: {json.dumps(response.get('daily_values', {}), indent=2)}")
+        
+        success, response = self.run_test(
+            "Warnings - personalized",
+            "POST",
+            f"nutrition/warnings?profile_id={profile_id}",
+            200,
+            data=self.sample_nutrition_data
+        )
+        if success:
+            print(f"Overall health score: {response.get('overall_health_score')}")
+        
+        deleted, _ = self.run_test("Profile - delete", "DELETE", f"profiles/{profile_id}", 200)
+        return success and deleted
+
+    def test_conditional_request(self):
+        """Test that a repeated request with If-None-Match gets 304"""
+        success, _ = self.run_test(
+            "Simplify - first request",
+            "POST",
+            "nutrition/simplify",
+            200,
+            data=self.sample_nutrition_data
+        )
+        if not success:
+            return False
+        etag = self.last_headers.get('ETag')
+        print(f"ETag: {etag}, Cache-Control: {self.last_headers.get('Cache-Control')}")
+        
+        success, _ = self.run_test(
+            "Simplify - If-None-Match",
+            "POST",
+            "nutrition/simplify",
+            304,
+            data=self.sample_nutrition_data,
+            extra_headers={'If-None-Match': etag}
+        )
+        changed_success, _ = self.run_test(
+            "Simplify - changed payload",
+            "POST",
+            "nutrition/simplify",
+            200,
+            data={**self.sample_nutrition_data, "sodium": 999},
+            extra_headers={'If-None-Match': etag}
+        )
+        return success and changed_success
+
+    def test_catalog_percentiles(self):
+        """Test percentile ranking and catalog add/delete"""
+        snack = {**self.sample_nutrition_data, "category": "snacks", "sodium": 600}
+        success, response = self.run_test(
+            "Percentiles - snacks",
+            "POST",
+            "nutrition/warnings?fields=percentiles",
+            200,
+            data=snack
+        )
+        if not success or not response.get('percentiles'):
+            return False
+        before = response['percentiles']
+        print(f"Sodium percentile: {before['nutrients']['sodium']} of {before['compared_with']} {before['category']}")
+        
+        success, _ = self.run_test(
+            "Catalog - add food",
+            "POST",
+            "nutrition/catalog",
+            200,
+            data=[{**snack, "id": "backend-test-salty-snack", "food_name": "Test Salty Snack", "sodium": 2000}],
+            extra_headers=self.admin_headers
+        )
+        if not success:
+            return False
+        success, response = self.run_test(
+            "Percentiles - after add",
+            "POST",
+            "nutrition/warnings?fields=percentiles",
+            200,
+            data=snack
+        )
+        added = success and response['percentiles']['compared_with'] == before['compared_with'] + 1
+        
+        deleted, _ = self.run_test(
+            "Catalog - delete food",
+            "DELETE",
+            "nutrition/catalog/backend-test-salty-snack",
+            200,
+            extra_headers=self.admin_headers
+        )
+        return added and deleted
+
+    def test_knowledge_ingestion(self):
+        """Test adding and deleting knowledge documents with background re-indexing"""
+        unauthorized, _ = self.run_test(
+            "Knowledge - missing admin token",
+            "POST",
+            "admin/knowledge",
+            401 if self.admin_headers['X-Admin-Token'] else 403,
+            data=[{"text": "Unauthorized document"}]
+        )
+        stats_unauthorized, _ = self.run_test(
+            "Knowledge - stats without admin token",
+            "GET",
+            "admin/knowledge/stats",
+            401 if self.admin_headers['X-Admin-Token'] else 403
+        )
+        unauthorized = unauthorized and stats_unauthorized
+        
+        success, before = self.run_test("Knowledge - stats", "GET", "admin/knowledge/stats", 200, extra_headers=self.admin_headers)
+        if not success:
+            return False
+        success, response = self.run_test(
+            "Knowledge - add document",
+            "POST",
+            "admin/knowledge",
+            202,
+            data=[{"id": "backend-test-doc", "text": "Backend test fact about sodium in snacks"}],
+            extra_headers=self.admin_headers
+        )
+        if not success:
+            return False
+        
+        for _ in range(20):
+            success, after = self.run_test("Knowledge - stats after add", "GET", "admin/knowledge/stats", 200, extra_headers=self.admin_headers)
+            if not success or not after.get('building'):
+                break
+            time.sleep(0.5)
+        print(f"Index: {after.get('indexed_documents')} documents, built in {after.get('build_seconds')}s")
+        indexed = (
+            success
+            and after.get('indexed_documents') == before.get('indexed_documents') + 1
+            and after.get('index_version') != before.get('index_version')
+        )
+        
+        deleted, _ = self.run_test(
+            "Knowledge - delete document",
+            "POST",
+            "admin/knowledge/delete",
+            202,
+            data={"ids": ["backend-test-doc"]},
+            extra_headers=self.admin_headers
+        )
+        return unauthorized and indexed and deleted
+
+    def test_retrieval_stats(self):
+        """Test that template and memo retrieval hits are reported"""
+        success, before = self.run_test("Retrieval - stats", "GET", "admin/knowledge/stats", 200, extra_headers=self.admin_headers)
+        if not success:
+            return False
+        
+        self.run_test(
+            "Retrieval - known health goal",
+            "POST",
+            "nutrition/health-goal?fields=suitability_verdict",
+            200,
+            data={"nutrition_data": self.sample_nutrition_data, "health_goal": "heart_health"}
+        )
+        for _ in range(2):
+            self.run_test(
+                "Retrieval - repeated chat question",
+                "POST",
+                "nutrition/chat",
+                200,
+                data={"nutrition_data": self.sample_nutrition_data, "question": "What about sodium?"}
+            )
+        
+        success, after = self.run_test("Retrieval - stats after", "GET", "admin/knowledge/stats", 200, extra_headers=self.admin_headers)
+        if not success:
+            return False
+        before, after = before['retrieval'], after['retrieval']
+        print(f"Retrieval stats: {json.dumps(after)}")
+        return (
+            after['precomputed_hits'] > before['precomputed_hits']
+            and after['memo_hits'] > before['memo_hits']
+        )
+
     def run_all_tests(self):
         """Run all API tests"""
         print("=" * 50)
@@ -182,10 +530,19 @@ class NutritionAPITester:
         # Test all endpoints
         health_success = self.test_health_endpoint()
         simplify_success = self.test_simplify_endpoint()
+        conditional_success = self.test_conditional_request()
         health_goal_success = self.test_health_goal_endpoint()
         diet_success = self.test_diet_compatibility_endpoint()
         chat_success = self.test_chat_endpoint()
+        chat_session_success = self.test_chat_session_endpoint()
+        chat_websocket_success = self.test_chat_websocket()
         warnings_success = self.test_warnings_endpoint()
+        fields_success = self.test_field_selection()
+        catalog_success = self.test_catalog_percentiles()
+        knowledge_success = self.test_knowledge_ingestion()
+        retrieval_success = self.test_retrieval_stats()
+        batch_success = self.test_batch_job()
+        profile_success = self.test_profile_scoring()
         
         # Print summary
         print("\n" + "=" * 50)
@@ -35,6 +35,7 @@ function App() {
   const [currentDietType, setCurrentDietType] = useState('keto');
   const [chatQuestion, setChatQuestion] = useState('');
   const [chatResponse, setChatResponse] = useState(null);
+  const [chatSessionId, setChatSessionId] = useState(null);
   const [loading, setLoading] = useState(false);
   const [isModelLoaded, setIsModelLoaded] = useState(false);
 
@@ -57,6 +58,11 @@ function App() {
     checkModelStatus();
   }, []);
 
+  useEffect(() => {
+    // Edited nutrition data needs a fresh chat session
+    setChatSessionId(null);
+  }, [nutritionData]);
+
   const checkModelStatus = async () => {
     try {
       const response = await fetch(`${API_BASE_URL}/api/health`);
@@ -144,16 +150,34 @@ function App() {
 
     setLoading(true);
     try {
-      const response = await fetch(`${API_BASE_URL}/api/nutrition/chat`, {
+      const startSession = () => fetch(`${API_BASE_URL}/api/nutrition/chat`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           nutrition_data: nutritionData,
           question: chatQuestion,
-          context: results.simplification?.simplified_explanation || ''
+          context: results.simplification?.simplified_explanation || '',
+          start_session: true
         })
       });
+      let response = chatSessionId ? await fetch(`${API_BASE_URL}/api/nutrition/chat`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          session_id: chatSessionId,
+          question: chatQuestion
+        })
+      }) : await startSession();
+      if (response.status === 404 && chatSessionId) {
+        // Session expired on the server, ask again once with the full record
+        setChatSessionId(null);
+        response = await startSession();
+      }
+      if (!response.ok) {
+        throw new Error(`Chat request failed: ${response.status}`);
+      }
       const data = await response.json();
+      setChatSessionId(data.session_id);
       setChatResponse(data);
     } catch (error) {
       console.error('Error with chat:', error);
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+
+RECORD = server.NutritionInput(
+    food_name="Greek Yogurt", calories=150, total_fat=8, saturated_fat=5, trans_fat=0, cholesterol=20, sodium=100,
+    total_carbs=10, dietary_fiber=0, total_sugars=10, added_sugars=8, protein=15
+)
+PARAMS = {"health_goal": None, "diet_type": None, "profile_id": None}
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """Food names of every record analyzed, in call order"""
+    calls = []
+    lock = threading.Lock()
+
+    def analyze(nutrition, **params):
+        with lock:
+            calls.append(nutrition.food_name)
+        return {"food_name": nutrition.food_name}
+
+    monkeypatch.setattr(server, "analyze_batch_record", analyze)
+    return calls
+
+
+def insert_job(db_path, status, chunks_done, owner=None, lease_expires=None):
+    """A job of 7 records in chunks of 3 whose first chunks are already written"""
+    manager = server.BatchJobManager(db_path, workers=1, chunk_size=3)
+    with server.sqlite_connection(db_path) as db:
+        db.execute(
+            "INSERT INTO batch_jobs (job_id, status, params, total, chunk_size, chunks_done, owner, lease_expires, "
+            "created_at, updated_at) VALUES ('job', ?, ?, 7, 3, ?, ?, ?, 0, 0)",
+            (status, json.dumps(PARAMS), chunks_done, owner, lease_expires)
+        )
+        db.executemany(
+            "INSERT INTO batch_job_records (job_id, idx, data) VALUES ('job', ?, ?)",
+            ((idx, RECORD.model_copy(update={"food_name": f"food-{idx}"}).model_dump_json()) for idx in range(7))
+        )
+    manager.executor.shutdown(wait=True)
+
+
+def wait_for(manager):
+    manager.executor.shutdown(wait=True)
+    return manager.status("job"), manager.results("job", 0, 100)
+
+
+def test_resume_continues_after_the_last_finished_chunk(tmp_path, analyzed):
+    db_path = str(tmp_path / "jobs.db")
+    insert_job(db_path, "running", chunks_done=1)
+
+    manager = server.BatchJobManager(db_path, workers=1, chunk_size=3)
+    assert manager.resume() == 1
+    status, results = wait_for(manager)
+
+    assert analyzed == [f"food-{idx}" for idx in range(3, 7)]
+    assert [result["index"] for result in results] == [3, 4, 5, 6]
+    assert status["status"] == "completed"
+    assert status["processed"] == 7
+
+
+def test_job_runs_once_across_managers_sharing_the_database(tmp_path, analyzed):
+    db_path = str(tmp_path / "jobs.db")
+    insert_job(db_path, "queued", chunks_done=0)
+
+    managers = [server.BatchJobManager(db_path, workers=1, chunk_size=3) for _ in range(3)]
+    for manager in managers:
+        manager.resume()
+    for manager in managers:
+        manager.executor.shutdown(wait=True)
+
+    assert sorted(analyzed) == [f"food-{idx}" for idx in range(7)]
+    assert managers[0].status("job")["status"] == "completed"
+
+
+def test_job_held_by_a_live_process_is_not_resumed(tmp_path, analyzed):
+    db_path = str(tmp_path / "jobs.db")
+    insert_job(db_path, "running", chunks_done=1, owner="other-process", lease_expires=time.time() + 60)
+
+    manager = server.BatchJobManager(db_path, workers=1, chunk_size=3)
+    assert manager.resume() == 0
+    status, _ = wait_for(manager)
+
+    assert analyzed == []
+    assert status["status"] == "running"
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+
+NUTRITION = server.NutritionInput(
+    food_name="Greek Yogurt", calories=150, total_fat=8, saturated_fat=5, trans_fat=0, cholesterol=20, sodium=100,
+    total_carbs=10, dietary_fiber=0, total_sugars=10, added_sugars=8, protein=15
+)
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    store = server.ChatSessionStore(max_sessions=10, max_turns=2, summary_max_chars=600)
+    monkeypatch.setattr(server, "chat_sessions", store)
+    monkeypatch.setattr(server, "rag_knowledge_base", server.create_rag_knowledge_base([]))
+    return store
+
+
+def test_initial_context_is_kept_for_later_turns(sessions):
+    session_id, _, _ = server.start_chat_turn(NUTRITION, None, "Is this healthy?", "Label explanation", start_session=True)
+    server.finish_chat_turn(session_id, "Is this healthy?", "Yes.", [])
+
+    _, prompt, _ = server.start_chat_turn(None, session_id, "What about sodium?")
+    assert "Label explanation" in prompt
+    assert prompt.count("Label explanation") == 1
+
+
+def test_session_ids_are_minted_by_the_server(sessions):
+    session_id, _, _ = server.start_chat_turn(NUTRITION, "chosen-by-client", "Is this healthy?")
+    assert session_id != "chosen-by-client"
+    assert sessions.get("chosen-by-client") is None
+
+
+def test_nutrition_data_resets_only_an_existing_session(sessions):
+    session_id = sessions.create(NUTRITION.model_dump())
+    sessions.add_turn(session_id, "Is this healthy?", "Yes.")
+
+    other = NUTRITION.model_copy(update={"food_name": "Candy Bar"})
+    assert server.start_chat_turn(other, session_id, "And now?")[0] == session_id
+    assert sessions.get(session_id)["nutrition_data"]["food_name"] == "Candy Bar"
+    assert sessions.get(session_id)["turns"] == []
+
+
+def test_missing_nutrition_and_session_is_a_validation_error(sessions):
+    with pytest.raises(HTTPException) as error:
+        server.start_chat_turn(None, None, "What about sodium?", start_session=True)
+    assert error.value.status_code == 422
+
+    with pytest.raises(HTTPException) as error:
+        server.start_chat_turn(None, "unknown", "What about sodium?")
+    assert error.value.status_code == 404
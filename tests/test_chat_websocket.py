@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+
+NUTRITION = {
+    "food_name": "Greek Yogurt", "calories": 150, "total_fat": 8, "saturated_fat": 5, "trans_fat": 0,
+    "cholesterol": 20, "sodium": 100, "total_carbs": 10, "dietary_fiber": 0, "total_sugars": 10,
+    "added_sugars": 8, "protein": 15
+}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "chat_sessions", server.ChatSessionStore(max_sessions=10, max_turns=6, summary_max_chars=600))
+    monkeypatch.setattr(server, "rag_knowledge_base", server.create_rag_knowledge_base([]))
+    return TestClient(server.app)
+
+
+def slow_response(prompt, max_length=200):
+    time.sleep(0.3)
+    return "First sentence. Second sentence. Third sentence."
+
+
+def test_chunks_are_streamed_in_order(client, monkeypatch):
+    monkeypatch.setattr(server, "generate_llm_response", slow_response)
+    with client.websocket_connect("/api/nutrition/chat/ws") as websocket:
+        websocket.send_text(json.dumps({"question": "Is this healthy?", "nutrition_data": NUTRITION}))
+        deltas = []
+        while True:
+            reply = websocket.receive_json()
+            if reply["type"] == "answer":
+                break
+            deltas.append(reply["delta"])
+    assert deltas == ["First sentence. ", "Second sentence. ", "Third sentence."]
+    assert reply["answer"] == "".join(deltas)
+
+
+def test_questions_beyond_the_pending_limit_are_refused(client, monkeypatch):
+    monkeypatch.setattr(server, "generate_llm_response", slow_response)
+    monkeypatch.setattr(server, "CHAT_WS_MAX_PENDING", 1)
+    with client.websocket_connect("/api/nutrition/chat/ws") as websocket:
+        websocket.send_text(json.dumps({"question": "Is this healthy?", "nutrition_data": NUTRITION}))
+        for _ in range(4):
+            websocket.send_text(json.dumps({"question": "What about sodium?"}))
+
+        answers, errors = 0, []
+        while answers + len(errors) < 5:
+            reply = websocket.receive_json()
+            if reply["type"] == "answer":
+                answers += 1
+            elif reply["type"] == "error":
+                errors.append(reply["detail"])
+    # At most one question generates and one waits while the others arrive; the rest are refused
+    assert answers <= 2
+    assert errors == ["Too many pending questions"] * (5 - answers)
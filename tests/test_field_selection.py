@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+
+NUTRITION = {
+    "food_name": "Greek Yogurt", "calories": 150, "total_fat": 8, "saturated_fat": 5, "trans_fat": 0,
+    "cholesterol": 20, "sodium": 100, "total_carbs": 10, "dietary_fiber": 0, "total_sugars": 10,
+    "added_sugars": 8, "protein": 15
+}
+
+
+def not_requested(*args, **kwargs):
+    raise AssertionError("builder for an unrequested field was called")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Prompt building, retrieval, generation and ranking all fail if reached
+    monkeypatch.setattr(server, "generate_llm_response", not_requested)
+    monkeypatch.setattr(server, "get_template_knowledge", not_requested)
+    monkeypatch.setattr(server, "get_relevant_knowledge", not_requested)
+    monkeypatch.setattr(server, "food_catalog", None)
+    return TestClient(server.app)
+
+
+def test_warnings_score_only_skips_llm_and_retrieval(client):
+    response = client.post("/api/nutrition/warnings?fields=overall_health_score", json=NUTRITION)
+    assert response.status_code == 200
+    assert response.json() == {"overall_health_score": server.calculate_overall_health_score(server.NutritionInput(**NUTRITION))}
+
+
+def test_health_goal_score_only_skips_llm_and_retrieval(client):
+    response = client.post(
+        "/api/nutrition/health-goal?fields=suitability_score",
+        json={"nutrition_data": NUTRITION, "health_goal": "weight_loss"}
+    )
+    assert response.status_code == 200
+    assert list(response.json()) == ["suitability_score"]
+
+
+def test_requested_builder_is_called(client):
+    # Sanity check that the stubs are actually reached when their field is requested
+    response = client.post("/api/nutrition/warnings?fields=ai_analysis", json=NUTRITION)
+    assert response.status_code == 500
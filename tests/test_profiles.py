@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+
+NUTRITION = {
+    "food_name": "Greek Yogurt", "calories": 150, "total_fat": 8, "saturated_fat": 5, "trans_fat": 0,
+    "cholesterol": 20, "sodium": 600, "total_carbs": 10, "dietary_fiber": 0, "total_sugars": 10,
+    "added_sugars": 8, "protein": 15, "category": "snacks"
+}
+ACTIVE_ADULT = server.NutritionProfileInput(age=30, weight_kg=90, height_cm=185, sex="male", activity_level="active")
+SEDENTARY_SENIOR = server.NutritionProfileInput(age=75, weight_kg=50, height_cm=155, sex="female", activity_level="sedentary")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    profiles = server.ProfileStore(str(tmp_path / "profiles.db"), cache_size=10)
+    monkeypatch.setattr(server, "profile_store", profiles)
+    return profiles
+
+
+def test_write_during_a_cache_miss_does_not_leave_a_stale_scorer(store, monkeypatch):
+    profile_id = store.save(ACTIVE_ADULT)
+    load = store.load
+
+    def load_then_update(requested_id):
+        # The PUT lands after the miss read the old row but before it caches the scorer
+        profile = load(requested_id)
+        store.save(SEDENTARY_SENIOR, requested_id)
+        return profile
+
+    monkeypatch.setattr(store, "load", load_then_update)
+    store.get_scorer(profile_id)
+    monkeypatch.setattr(store, "load", load)
+
+    expected = server.derive_personal_daily_values(SEDENTARY_SENIOR)["calories"]
+    assert store.get_scorer(profile_id)["daily_values"]["calories"] == expected
+
+
+def test_cached_scorer_does_not_read_the_database(store, monkeypatch):
+    profile_id = store.save(ACTIVE_ADULT)
+    scorer = store.get_scorer(profile_id)
+
+    def no_reads(profile_id):
+        raise AssertionError("cache hit read SQLite")
+
+    monkeypatch.setattr(store, "load", no_reads)
+    assert asyncio.run(server.resolve_scorer_async(profile_id)) is scorer
+    assert asyncio.run(server.resolve_scorer_async(None)) is server.GLOBAL_SCORER
+
+
+def test_percentiles_rank_the_global_score_for_every_profile(store, monkeypatch):
+    monkeypatch.setattr(server, "food_catalog", server.FoodCatalog("/nonexistent/catalog.json", server.FOOD_CATALOG_SEED_PATH))
+    client = TestClient(server.app)
+    profile_id = store.save(SEDENTARY_SENIOR)
+
+    default = client.post("/api/nutrition/warnings?fields=overall_health_score,percentiles", json=NUTRITION).json()
+    personal = client.post(
+        f"/api/nutrition/warnings?fields=overall_health_score,percentiles&profile_id={profile_id}", json=NUTRITION
+    ).json()
+
+    assert personal["overall_health_score"] != default["overall_health_score"]
+    assert personal["percentiles"] == default["percentiles"]
+    assert personal["percentiles"]["scoring"] == "global"
+    assert personal["percentiles"]["global_overall_health_score"] == default["overall_health_score"]
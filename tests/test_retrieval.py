@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server
+
+
+@pytest.fixture
+def knowledge_base(monkeypatch):
+    """Index built from the guidelines plus documents that overlap the templates' variable parts"""
+    documents = [
+        {"id": "calories", "text": "A 150.0 calorie snack counts as light"},
+        {"id": "yogurt", "text": "Greek yogurt is high in protein"},
+        {"id": "candy", "text": "Candy alerts for added sugar"},
+        {"id": "keto", "text": "keto dieters should watch net carbs"}
+    ]
+    monkeypatch.setattr(server, "rag_knowledge_base", server.create_rag_knowledge_base(documents))
+    for key in server.retrieval_stats:
+        monkeypatch.setitem(server.retrieval_stats, key, 0)
+    return server.rag_knowledge_base
+
+
+TEMPLATE_CASES = [
+    ("simplify", "calories", [0.0, 5.0, 150.0, 300.0, 2000.0]),
+    ("health_goal", "health_goal", list(server.NUTRITION_GUIDELINES["health_goals"]) + ["unknown_goal", "muscle gain"]),
+    ("diet_compatibility", "diet_type", list(server.NUTRITION_GUIDELINES["diet_compatibility"]) + ["carnivore"]),
+    ("warnings", "food_name", ["Greek Yogurt", "Candy Bar", "Food Item", "zzz"])
+]
+
+
+@pytest.mark.parametrize("template,variable,values", TEMPLATE_CASES)
+def test_template_knowledge_matches_full_scan(knowledge_base, template, variable, values):
+    for value in values:
+        for top_k in (1, 3, 10):
+            query = server.RETRIEVAL_TEMPLATES[template].format(**{variable: value})
+            assert server.get_template_knowledge(template, top_k=top_k, **{variable: value}) == \
+                server.get_relevant_knowledge(query, top_k)
+
+
+def test_template_paths_are_counted(knowledge_base):
+    server.get_template_knowledge("health_goal", health_goal="weight_loss")
+    server.get_template_knowledge("simplify", calories=300.0)
+    server.get_template_knowledge("warnings", food_name="Greek Yogurt")
+
+    stats = server.get_retrieval_stats()
+    assert stats["precomputed_hits"] == 1
+    assert stats["normalized_hits"] == 1
+    assert stats["template_misses"] == 1
+    assert stats["template_hit_rate"] == round(2 / 3, 3)
+
+
+def test_memo_matches_full_scan_and_counts_hits(knowledge_base):
+    for question in ["What about sodium?", "what  about SODIUM?", "protein", "What about sodium?"]:
+        assert server.get_cached_knowledge(question) == server.get_relevant_knowledge(question)
+
+    stats = server.get_retrieval_stats()
+    assert stats["memo_misses"] == 2
+    assert stats["memo_hits"] == 2
+    assert stats["memo_hit_rate"] == 0.5
+    assert stats["memo_size"] == 2
+
+
+def test_memo_is_bounded(knowledge_base, monkeypatch):
+    monkeypatch.setattr(server, "RETRIEVAL_MEMO_SIZE", 2)
+    for question in ["sodium", "protein", "fiber"]:
+        server.get_cached_knowledge(question)
+
+    assert list(key for key, _ in knowledge_base["memo"]) == ["protein", "fiber"]
+
+
+def test_rebuild_starts_a_fresh_memo(knowledge_base, monkeypatch):
+    server.get_cached_knowledge("sodium")
+    monkeypatch.setattr(server, "rag_knowledge_base", server.create_rag_knowledge_base())
+
+    server.get_cached_knowledge("sodium")
+    assert server.get_retrieval_stats()["memo_misses"] == 2